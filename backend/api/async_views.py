@@ -0,0 +1,116 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from django.urls import URLPattern
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class AsyncReadMixin:
+    """Асинхронные list и retrieve вьюсета для запуска под ASGI.
+
+    Используются те же get_queryset, сериализаторы, права, ограничения
+    частоты и пагинация, что и в синхронных действиях. Выборка идёт
+    через асинхронный ORM (acount, aget, async for); аутентификация,
+    права и фильтры django-filter синхронные и выполняются одним
+    переходом в поток запроса. Действия не из async_actions и изменяющие
+    запросы обрабатываются синхронной вьюхой.
+    """
+    async_actions = ('list', 'retrieve')
+
+    async def adispatch(self, request, *args, **kwargs):
+        """Асинхронный вариант APIView.dispatch."""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs)
+        return self.response
+
+    async def afilter_queryset(self):
+        return await sync_to_async(self.filter_queryset)(self.get_queryset())
+
+    async def apaginate_queryset(self, queryset):
+        paginator = self.paginator
+        if paginator is None:
+            return None
+        if hasattr(paginator, 'apaginate_queryset'):
+            return await paginator.apaginate_queryset(
+                queryset, self.request, view=self)
+        return await sync_to_async(paginator.paginate_queryset)(
+            queryset, self.request, view=self)
+
+    async def aget_object(self):
+        queryset = await self.afilter_queryset()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+                ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset()
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(
+            [instance async for instance in queryset], many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
+
+
+def async_view(view):
+    """Асинхронная вьюха из результата as_view() вьюсета или APIView.
+
+    GET и HEAD действий из async_actions выполняются adispatch в цикле
+    событий, остальное - исходной синхронной вьюхой.
+    """
+    cls = view.cls
+    actions = getattr(view, 'actions', None)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        action = actions.get('get') if actions else 'list'
+        if (request.method not in SAFE_METHODS
+                or action not in cls.async_actions):
+            return await sync_to_async(view)(request, *args, **kwargs)
+        self = cls(**view.initkwargs)
+        if actions:
+            # То же, что делает ViewSetMixin.as_view.
+            self.action_map = {**actions, 'head': actions['get']}
+            for method, name in self.action_map.items():
+                setattr(self, method, getattr(self, name))
+        self.action = action
+        return await self.adispatch(request, *args, **kwargs)
+
+    return wrapper
+
+
+def asyncify(patterns):
+    """Заменяет вьюхи маршрутов роутера с AsyncReadMixin асинхронными."""
+    return [
+        URLPattern(
+            pattern.pattern, async_view(pattern.callback),
+            pattern.default_args, pattern.name)
+        if issubclass(pattern.callback.cls, AsyncReadMixin) else pattern
+        for pattern in patterns
+    ]
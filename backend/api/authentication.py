@@ -0,0 +1,141 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from .replicas import use_primary
+
+TOKEN_KEY = 'auth:token:{}'
+# Поля пользователя, которые не попадают в кеш. Счётчики меняются
+# без сохранения пользователя, а пароль незачем хранить в общем кеше.
+# Отложенные поля читаются из базы только при обращении к ним,
+# и save() их не перезаписывает.
+DEFERRED_FIELDS = ('password', 'recipes_count', 'followers_count')
+
+
+class TokenCache:
+    """Пользователи по токенам: LRU в памяти процесса и общий кеш.
+
+    Записи живут TOKEN_CACHE_TIMEOUT секунд, в памяти хранится
+    не больше TOKEN_CACHE_SIZE записей. При выходе, изменении или
+    удалении пользователя записи удаляются из памяти текущего процесса
+    и из общего кеша TOKEN_CACHE_ALIAS; в остальных процессах они
+    доживают не дольше TOKEN_CACHE_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.keys_by_user = {}
+
+    @property
+    def shared(self):
+        alias = settings.TOKEN_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def get(self, key):
+        """Копия пользователя из кеша или None."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                user, expires = entry
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    return copy.copy(user)
+                self.discard(key)
+        if self.shared is None:
+            return None
+        user = self.shared.get(TOKEN_KEY.format(key))
+        if user is None:
+            return None
+        self.remember(key, user)
+        return copy.copy(user)
+
+    def set(self, key, user):
+        if not settings.TOKEN_CACHE_SIZE:
+            return
+        user = copy.copy(user)
+        self.remember(key, user)
+        if self.shared is not None:
+            self.shared.set(
+                TOKEN_KEY.format(key), user, settings.TOKEN_CACHE_TIMEOUT)
+
+    def remember(self, key, user):
+        expires = time.monotonic() + settings.TOKEN_CACHE_TIMEOUT
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = (user, expires)
+            self.keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        """Удаляет запись из памяти; вызывается под self.lock."""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[0].pk
+        keys = self.keys_by_user.get(user_id, set())
+        keys.discard(key)
+        if not keys:
+            self.keys_by_user.pop(user_id, None)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.discard(key)
+        if self.shared is not None:
+            self.shared.delete(TOKEN_KEY.format(key))
+
+    def invalidate_user(self, user_id):
+        """Удаляет записи всех токенов пользователя."""
+        with self.lock:
+            for key in list(self.keys_by_user.get(user_id, ())):
+                self.discard(key)
+        if self.shared is not None:
+            keys = Token.objects.filter(
+                user_id=user_id).values_list('key', flat=True)
+            self.shared.delete_many([TOKEN_KEY.format(key) for key in keys])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_user.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе для недавних токенов.
+
+    Активный пользователь после проверки токена сохраняется
+    в token_cache; неизвестные токены и неактивные пользователи
+    каждый раз проверяются по базе.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            model = self.get_model()
+            try:
+                # Только что выданного токена на реплике может ещё не быть.
+                with use_primary():
+                    token = model.objects.select_related('user').defer(
+                        *(f'user__{field}' for field in DEFERRED_FIELDS)
+                    ).get(key=key)
+            except model.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            user = token.user
+            if not user.is_active:
+                raise AuthenticationFailed(_('User inactive or deleted.'))
+            token_cache.set(key, user)
+            return (user, token)
+        return (user, Token(key=key, user=user))
@@ -0,0 +1,232 @@
+import base64
+import collections
+import json
+import mimetypes
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import F, Prefetch
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.exceptions import ValidationError
+from recipes.feeds import fan_out
+from recipes.images import schedule_image_processing
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.storage import content_storage
+from recipes.versions import bump_version
+from users.models import User
+
+from .serializers import RecipeImportSerializer
+
+EXPORT_CHUNK_SIZE = 500
+IMPORT_BATCH_SIZE = 500
+# Сколько ошибок по строкам возвращается в отчёте импорта.
+MAX_REPORTED_ERRORS = 1000
+
+
+def inline_image(name):
+    """Изображение из хранилища в виде data URI."""
+    content_type = mimetypes.guess_type(name)[0] or 'image/png'
+    with content_storage.open(name) as file:
+        encoded = base64.b64encode(file.read()).decode()
+    return f'data:{content_type};base64,{encoded}'
+
+
+def export_recipes(inline_images=False):
+    """Рецепты в формате NDJSON, по одной строке на рецепт.
+
+    Рецепты читаются курсором на сервере порциями по EXPORT_CHUNK_SIZE
+    вместе с тегами и ингредиентами, поэтому расход памяти не зависит
+    от размера каталога. Формат строки совпадает с форматом импорта.
+    """
+    recipes = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')),
+    ).order_by('id')
+    for recipe in recipes.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        image = recipe.image.name
+        if inline_images and image:
+            image = inline_image(image)
+        yield json.dumps({
+            'id': recipe.id,
+            'author': recipe.author.email,
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'image': image,
+            'tags': [tag.slug for tag in recipe.tags.all()],
+            'ingredients': [{
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            } for item in recipe.ingredients.all()],
+        }, ensure_ascii=False) + '\n'
+
+
+class RecipeImporter:
+    """Импорт рецептов из NDJSON пачками по batch_size строк.
+
+    Каждая строка проверяется отдельно, ссылки на теги, ингредиенты
+    и авторов - одним запросом на пачку. Корректные строки пачки
+    вставляются bulk_create в одной транзакции, ошибочные попадают
+    в отчёт с номером строки и не мешают остальным.
+    """
+
+    def __init__(self, user, batch_size=IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.image_field = Recipe._meta.get_field('image')
+
+    def run(self, lines):
+        batch = []
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                batch.append((number, line))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        self.errors.sort(key=lambda error: error['line'])
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+    def error(self, number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': number, 'errors': errors})
+
+    def parse(self, batch):
+        rows = []
+        for number, line in batch:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                self.error(
+                    number, {'non_field_errors': ['Некорректный JSON.']})
+                continue
+            serializer = RecipeImportSerializer(data=data)
+            if serializer.is_valid():
+                rows.append((number, serializer.validated_data))
+            else:
+                self.error(number, serializer.errors)
+        return rows
+
+    def import_batch(self, batch):
+        rows = self.parse(batch)
+        tags = dict(Tag.objects.filter(slug__in={
+            slug for _, row in rows for slug in row['tags']
+        }).values_list('slug', 'id'))
+        ingredients = {
+            (name, unit): pk
+            for pk, name, unit in Ingredient.objects.filter(name__in={
+                item['name'] for _, row in rows for item in row['ingredients']
+            }).values_list('id', 'name', 'measurement_unit')
+        }
+        authors = dict(User.objects.filter(email__in={
+            row['author'] for _, row in rows if 'author' in row
+        }).values_list('email', 'id'))
+
+        recipes = []
+        for number, row in rows:
+            errors = {}
+            missing = [slug for slug in row['tags'] if slug not in tags]
+            if missing:
+                errors['tags'] = [f'Теги не найдены: {", ".join(missing)}']
+            missing = [
+                f'{item["name"]} ({item["measurement_unit"]})'
+                for item in row['ingredients']
+                if (item['name'], item['measurement_unit']) not in ingredients
+            ]
+            if missing:
+                errors['ingredients'] = [
+                    f'Ингредиенты не найдены: {", ".join(missing)}']
+            author = row.get('author')
+            if author is not None and author not in authors:
+                errors['author'] = [f'Пользователь {author} не найден.']
+            if errors:
+                self.error(number, errors)
+                continue
+            try:
+                image = self.save_image(row['image'])
+            except ValidationError as error:
+                self.error(number, {'image': error.detail})
+                continue
+            recipes.append((Recipe(
+                author_id=authors[author] if author else self.user.id,
+                name=row['name'],
+                text=row['text'],
+                cooking_time=row['cooking_time'],
+                image=image,
+            ), row))
+        if recipes:
+            self.insert(recipes, tags, ingredients)
+
+    def save_image(self, value):
+        """Имя файла изображения в хранилище.
+
+        Изображение в base64 сохраняется (одинаковые файлы хранятся один
+        раз), имя файла принимается, только если такой файл уже есть.
+        """
+        if not value.startswith('data:'):
+            upload_to = self.image_field.upload_to
+            try:
+                exists = (value.startswith(upload_to)
+                          and content_storage.exists(value))
+            except SuspiciousFileOperation:
+                exists = False
+            if not exists:
+                raise ValidationError([f'Файл {value} не найден.'])
+            return value
+        image = Base64ImageField().to_internal_value(value)
+        return content_storage.save(
+            self.image_field.generate_filename(None, image.name), image)
+
+    @transaction.atomic
+    def insert(self, recipes, tags, ingredients):
+        """Вставляет рецепты пачки и делает то, что при обычном
+        сохранении выполняют сигналы: счётчики, поиск, версии, обработку
+        изображений, рассылку в ленты подписчиков."""
+        created = Recipe.objects.bulk_create(
+            [recipe for recipe, _ in recipes])
+        pairs = [(recipe, row) for recipe, (_, row) in zip(created, recipes)]
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tags[slug])
+            for recipe, row in pairs
+            for slug in set(row['tags'])
+        ])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe_id=recipe.id,
+                ingredient_id=ingredients[
+                    (item['name'], item['measurement_unit'])],
+                amount=item['amount'],
+            )
+            for recipe, row in pairs
+            for item in row['ingredients']
+        ])
+        Recipe.objects.filter(
+            id__in=[recipe.id for recipe in created]).update_search_vector()
+        per_author = collections.Counter(
+            recipe.author_id for recipe in created)
+        for author_id, count in per_author.items():
+            User.objects.filter(pk=author_id).update(
+                recipes_count=F('recipes_count') + count)
+        for recipe in created:
+            schedule_image_processing(recipe)
+        published = [(recipe.id, recipe.author_id) for recipe in created]
+
+        def publish():
+            bump_version(Recipe)
+            for recipe_id, author_id in published:
+                fan_out(recipe_id, author_id)
+
+        transaction.on_commit(publish)
+        self.created += len(created)
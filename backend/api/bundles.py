@@ -0,0 +1,159 @@
+import gzip
+import os
+import tempfile
+import threading
+
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import quote_etag
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from recipes.models import Ingredient, Tag
+from recipes.versions import get_version
+
+from .ingredient_index import ingredient_index, load_rows
+from .replicas import use_primary
+from .serializers import TagSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Расширения файлов для nginx (gzip_static, brotli_static).
+EXTENSIONS = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+
+
+def render_tags(fresh=False):
+    return TagSerializer(Tag.objects.all(), many=True).data
+
+
+def render_ingredients(fresh=False):
+    if fresh:
+        return load_rows()
+    return ingredient_index.search()
+
+
+# Справочники: модель, от версии которой зависит содержимое,
+# и функция, возвращающая те же данные, что и list во вьюсете;
+# с fresh=True данные читаются из базы в обход кешей в памяти.
+SOURCES = {
+    'tags': (Tag, render_tags),
+    'ingredients': (Ingredient, render_ingredients),
+}
+
+
+class Bundle:
+    """Готовый JSON справочника и его сжатые варианты."""
+
+    def __init__(self, name, version, content):
+        self.name = name
+        self.version = version
+        self.variants = {
+            'identity': content,
+            'gzip': gzip.compress(content, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(content, quality=11)
+
+    def get_etag(self, encoding):
+        """Свой ETag у каждого варианта: тела у них разные."""
+        return quote_etag(f'{self.name}-{self.version}-{encoding}')
+
+    def negotiate(self, accept_encoding):
+        """Лучший из доступных вариантов по заголовку Accept-Encoding."""
+        accepted = set()
+        for item in accept_encoding.split(','):
+            coding, *params = item.split(';')
+            quality = 1.0
+            for param in params:
+                key, _, value = param.strip().partition('=')
+                if key == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                accepted.add(coding.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (
+                    encoding in accepted or '*' in accepted):
+                return encoding
+        return 'identity'
+
+    def export(self, directory):
+        """Записывает name.json и сжатые копии рядом.
+
+        Файлы заменяются атомарно, чтобы nginx не отдал недописанный файл.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for encoding, content in self.variants.items():
+            path = os.path.join(
+                directory, f'{self.name}.json{EXTENSIONS[encoding]}')
+            descriptor, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(content)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+            paths.append(path)
+        return paths
+
+
+class BundleStore:
+    """Справочники в памяти процесса.
+
+    Бандл пересобирается лениво при первом запросе после изменения
+    версии модели (см. recipes.versions).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bundles = {}
+
+    def get(self, name):
+        model, render = SOURCES[name]
+        version = get_version(model)
+        bundle = self.bundles.get(name)
+        if bundle is not None and bundle.version == version:
+            return bundle
+        with self.lock:
+            bundle = self.bundles.get(name)
+            if bundle is None or bundle.version != version:
+                with use_primary():
+                    content = JSONRenderer().render(render())
+                bundle = Bundle(name, version, content)
+                self.bundles[name] = bundle
+        return bundle
+
+    def build(self, name):
+        """Бандл из текущих данных базы без кешей в памяти и без версии.
+
+        Нужен для выгрузки сразу после фиксации изменений: версия модели
+        увеличивается своим обработчиком on_commit, который может
+        выполниться позже, и get() вернул бы ещё старые данные.
+        """
+        model, render = SOURCES[name]
+        with use_primary():
+            content = JSONRenderer().render(render(fresh=True))
+        return Bundle(name, get_version(model), content)
+
+
+def bundle_response(request, bundle):
+    """Ответ с подходящим клиенту вариантом бандла или 304."""
+    encoding = bundle.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    etag = bundle.get_etag(encoding)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(
+            bundle.variants[encoding], content_type='application/json')
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+        response['Content-Length'] = len(bundle.variants[encoding])
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+bundle_store = BundleStore()
@@ -0,0 +1,132 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+from recipes.versions import get_versions
+
+from .replicas import use_primary
+
+
+class VersionedCacheMixin:
+    """Кеширование list и retrieve с ключом из версий моделей.
+
+    В ключ входят версии всех моделей из cache_models, поэтому любое
+    изменение этих моделей сразу делает старые записи недостижимыми.
+    Персональные поля в ответе из кеша пересчитываются в personalize()
+    для текущего пользователя, так что кеш общий для анонимных
+    и авторизованных пользователей. Запросы с параметрами
+    из personal_query_params не кешируются.
+
+    Ответы получают ETag из того же ключа, поэтому условный запрос
+    с If-None-Match получает 304 без обращения к базе и сериализации.
+    Last-Modified не отправляется: ответ зависит от нескольких моделей,
+    и дата изменения одной из них не отражает изменений остальных.
+    Для асинхронных действий (api.async_views) те же шаги выполняет
+    aget_cached_response; alist и aretrieve требуют AsyncReadMixin
+    следующим в MRO.
+    """
+    cache_models = ()
+    personal_query_params = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.aget_cached_response(
+            super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.aget_cached_response(
+            super().aretrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request):
+        versions = '.'.join(map(str, get_versions(self.cache_models)))
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        return f'response-data:{self.basename}:{self.action}:{versions}:{url}'
+
+    def get_etag(self, request, key):
+        """ETag ответа; в ключе кеша уже учтены версии данных и URL."""
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def is_personal(self, request):
+        """Есть ли в ответе поля текущего пользователя."""
+        return False
+
+    def skip_cache(self, request):
+        return any(param in request.query_params
+                   for param in self.personal_query_params)
+
+    def get_key_and_etag(self, request):
+        key = self.get_cache_key(request)
+        return key, self.get_etag(request, key)
+
+    def get_not_modified(self, request, etag):
+        """304 по If-None-Match до чтения кеша."""
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return self.add_validators(request, response, etag)
+        return None
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if self.skip_cache(request):
+            return handler(request, *args, **kwargs)
+        key, etag = self.get_key_and_etag(request)
+        response = self.get_not_modified(request, etag)
+        if response is not None:
+            return response
+        data = cache.get(key)
+        if data is None:
+            with use_primary():
+                response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        else:
+            response = Response(self.personalize(request, data))
+        return self.add_validators(request, response, etag)
+
+    async def aget_cached_response(self, handler, request, *args, **kwargs):
+        """То же, что get_cached_response, для асинхронных обработчиков."""
+        if self.skip_cache(request):
+            return await handler(request, *args, **kwargs)
+        key, etag = await sync_to_async(self.get_key_and_etag)(request)
+        response = self.get_not_modified(request, etag)
+        if response is not None:
+            return response
+        data = await cache.aget(key)
+        if data is None:
+            with use_primary():
+                response = await handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            await cache.aset(
+                key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        else:
+            response = Response(await self.apersonalize(request, data))
+        return self.add_validators(request, response, etag)
+
+    def add_validators(self, request, response, etag):
+        """ETag и обязательная перепроверка у клиента."""
+        response['ETag'] = etag
+        if self.is_personal(request):
+            patch_cache_control(response, no_cache=True, private=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    def personalize(self, request, data):
+        """Подставляет в данные из кеша поля текущего пользователя."""
+        return data
+
+    async def apersonalize(self, request, data):
+        """personalize() для асинхронных действий."""
+        return data
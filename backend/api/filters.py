@@ -1,5 +1,8 @@
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramWordSimilarity)
+from django.db.models import F, Q
 from django_filters.rest_framework import CharFilter, FilterSet, filters
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import SEARCH_CONFIG, Ingredient, Recipe, Tag
 
 
 class RecipeFilter(FilterSet):
@@ -13,10 +16,14 @@ class RecipeFilter(FilterSet):
         method='get_favorite')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.OrderingFilter(
+        fields=('favorites_count', 'shopping_cart_count', 'id'))
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering']
 
     def get_favorite(self, queryset, name, value):
         if value:
@@ -28,6 +35,28 @@ class RecipeFilter(FilterSet):
             return queryset.filter(shopping_cart__user=self.request.user)
         return queryset
 
+    def get_search(self, queryset, name, value):
+        """Полнотекстовый поиск с учётом опечаток в названии.
+
+        Совпадения по вектору ищутся через GIN-индекс search_vector,
+        похожие названия - через триграммный индекс по name.
+        Результаты упорядочены по релевантности.
+        """
+        value = value.strip()
+        if not value:
+            return queryset
+        if queryset.db_vendor != 'postgresql':
+            return queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value))
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(
+            Q(search_vector=query) | Q(name__trigram_word_similar=value)
+        ).annotate(
+            rank=SearchRank(F('search_vector'), query),
+            similarity=TrigramWordSimilarity(value, 'name'),
+        ).order_by('-rank', '-similarity', '-id')
+
 
 class IngredientFilter(FilterSet):
     """Фильтр для ингредиентов."""
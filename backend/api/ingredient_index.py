@@ -0,0 +1,58 @@
+import bisect
+import threading
+
+from recipes.models import Ingredient
+from recipes.versions import get_version
+
+from .replicas import use_primary
+
+
+def normalize(name):
+    """Ключ поиска: без учёта регистра, ё и е не различаются."""
+    return name.casefold().replace('ё', 'е')
+
+
+def load_rows():
+    """Все ингредиенты из основной базы в порядке индекса."""
+    with use_primary():
+        return sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda row: (normalize(row['name']), row['id']))
+
+
+class IngredientIndex:
+    """Отсортированный префиксный индекс ингредиентов в памяти процесса.
+
+    Индекс пересобирается лениво при первом запросе после изменения
+    версии модели Ingredient (см. recipes.versions).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.data = ([], [])
+
+    def refresh(self):
+        version = get_version(Ingredient)
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            rows = load_rows()
+            self.data = ([normalize(row['name']) for row in rows], rows)
+            self.version = version
+
+    def search(self, prefix='', limit=None):
+        """Ингредиенты, название которых начинается с prefix."""
+        self.refresh()
+        keys, rows = self.data
+        prefix = normalize(prefix)
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + '\U0010ffff', lo=start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return rows[start:end]
+
+
+ingredient_index = IngredientIndex()
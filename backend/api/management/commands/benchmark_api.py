@@ -0,0 +1,413 @@
+import base64
+import io
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from recipes.counters import reconcile
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingList, Tag,
+                            TimelineEntry)
+from users.models import Follow, User
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'data' / 'baseline.json'
+INGREDIENTS_PATH = (
+    settings.BASE_DIR / 'recipes' / 'management' / 'commands' / 'data'
+    / 'ingredients.json'
+)
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def make_image():
+    """Картинка для создания рецепта в формате base64."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), '#E26C2D').save(buffer, format='PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер количества запросов, времени и размера ответа '
+        'для всех эндпоинтов API на тестовой базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', type=int, default=1,
+            help='Множитель объёма синтетических данных.')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Количество повторов каждого запроса.')
+        parser.add_argument(
+            '--seed', type=int, default=42,
+            help='Зерно генератора синтетических данных.')
+        parser.add_argument(
+            '--baseline', default=str(BASELINE_PATH),
+            help='Путь к файлу с эталонными замерами.')
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Перезаписать эталон текущей СУБД текущими замерами.')
+        parser.add_argument(
+            '--time-tolerance', type=float, default=2.0,
+            help='Допустимое замедление относительно эталона (разы).')
+        parser.add_argument(
+            '--size-tolerance', type=float, default=0.1,
+            help='Допустимый рост размера ответа (доля).')
+        parser.add_argument(
+            '--output',
+            help='Сохранить замеры в JSON-файл.')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Не удалять тестовую базу после замера.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, keepdb=options['keepdb'])
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                # Изображения и ленты обрабатываются синхронно, чтобы
+                # фоновые потоки не влияли на замеры и не переживали базу.
+                # Частота запросов не ограничивается: сценарии повторяют
+                # дорогие запросы подряд. Кеш свой, чтобы не смешивать
+                # тестовые данные с общим кешем работающего приложения.
+                with override_settings(
+                        MEDIA_ROOT=media_root, IMAGE_WORKERS=0,
+                        FEED_WORKERS=0,
+                        CACHES={'default': {
+                            'BACKEND': 'django.core.cache.backends.locmem.'
+                                       'LocMemCache',
+                            'LOCATION': 'benchmark',
+                        }},
+                        REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                        'DEFAULT_THROTTLE_RATES': {}}):
+                    self.build_dataset(options['scale'], options['seed'])
+                    results = self.run_cases(options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.report(results)
+        if options['output']:
+            self.dump(options['output'], options, results)
+        if options['update_baseline']:
+            self.update_baseline(options, results)
+            self.stdout.write(self.style.SUCCESS(
+                f'Эталон {connection.vendor} сохранён '
+                f'в {options["baseline"]}'))
+            return
+        regressions = self.compare(results, options)
+        if regressions:
+            raise CommandError(
+                'Обнаружены регрессии:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий не обнаружено.'))
+
+    def build_dataset(self, scale, seed):
+        """Детерминированный синтетический набор данных."""
+        rnd = random.Random(seed)
+        with open(INGREDIENTS_PATH, 'rb') as f:
+            Ingredient.objects.bulk_create(
+                Ingredient(**item) for item in json.load(f))
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        tags = Tag.objects.bulk_create(
+            Tag(name=name, color=color, slug=slug)
+            for name, color, slug in TAGS)
+        User.objects.bulk_create(
+            User(
+                email=f'user{i}@example.com',
+                username=f'user{i}',
+                first_name=f'Имя{i}',
+                last_name=f'Фамилия{i}',
+            ) for i in range(20 * scale))
+        users = list(User.objects.order_by('id'))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=users[min(int(rnd.paretovariate(1.2)) - 1,
+                                 len(users) - 1)],
+                name=f'Рецепт {i}',
+                image=f'recipes/images/{i}.png',
+                text=f'Описание рецепта {i}. ' * 10,
+                cooking_time=rnd.randint(1, 120),
+            ) for i in range(100 * scale))
+        Recipe.objects.update_search_vector()
+        recipes = list(Recipe.objects.order_by('id'))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes
+            for tag in rnd.sample(tags, rnd.randint(1, len(tags))))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient,
+                amount=rnd.randint(1, 500))
+            for recipe in recipes
+            for ingredient in rnd.sample(ingredients, rnd.randint(3, 12)))
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=recipe)
+            for user in users
+            for recipe in rnd.sample(
+                recipes, 20 if user == users[0] else rnd.randint(0, 20)))
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe=recipe)
+            for user in users
+            for recipe in rnd.sample(
+                recipes, 10 if user == users[0] else rnd.randint(0, 10)))
+        Follow.objects.bulk_create(
+            Follow(user=user, author=author)
+            for user in users
+            for author in rnd.sample(
+                users, 8 if user == users[0] else rnd.randint(0, 8))
+            if author != user)
+
+        self.user = users[0]
+        self.other = users[-1]
+        self.recipe = recipes[len(recipes) // 2]
+        Follow.objects.filter(user=self.user, author=self.other).delete()
+        Favorite.objects.filter(user=self.user, recipe=self.recipe).delete()
+        ShoppingCart.objects.filter(
+            user=self.user, recipe=self.recipe).delete()
+        ShoppingList.objects.rebuild()
+        reconcile()
+        TimelineEntry.objects.rebuild()
+        self.ingredients = ingredients[:3]
+        self.tags = tags
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def get_cases(self):
+        """Сценарии: (название, клиент, метод, url, данные)."""
+        anon = self.get_client()
+        user = self.get_client(self.user)
+        recipe_id = self.recipe.id
+        author_id = self.recipe.author_id
+        other_id = self.other.id
+        recipe_data = {
+            'ingredients': [
+                {'id': ingredient, 'amount': 10}
+                for ingredient in self.ingredients],
+            'tags': [tag.id for tag in self.tags],
+            'image': make_image(),
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+        }
+        return [
+            ('recipes_list_anon', anon, 'get', '/api/recipes/', None),
+            ('recipes_list', user, 'get', '/api/recipes/', None),
+            ('recipes_list_page', user, 'get',
+             '/api/recipes/?page=3&limit=12', None),
+            ('recipes_list_cursor', user, 'get',
+             '/api/recipes/?cursor=', None),
+            ('recipes_filter_tags', user, 'get',
+             '/api/recipes/?tags=breakfast&tags=dinner', None),
+            ('recipes_filter_author', user, 'get',
+             f'/api/recipes/?author={author_id}', None),
+            ('recipes_filter_is_favorited', user, 'get',
+             '/api/recipes/?is_favorited=1', None),
+            ('recipes_filter_is_in_shopping_cart', user, 'get',
+             '/api/recipes/?is_in_shopping_cart=1', None),
+            ('recipes_ordering_favorites', user, 'get',
+             '/api/recipes/?ordering=-favorites_count,-id', None),
+            ('recipes_search', user, 'get',
+             '/api/recipes/?search=%D0%A0%D0%B5%D1%86%D0%B5%D0%BF%D1%82%201',
+             None),
+            ('recipes_detail_anon', anon, 'get',
+             f'/api/recipes/{recipe_id}/', None),
+            ('recipes_detail', user, 'get',
+             f'/api/recipes/{recipe_id}/', None),
+            ('recipes_create', user, 'post', '/api/recipes/', recipe_data),
+            ('recipes_update', user, 'patch',
+             '/api/recipes/{created}/', recipe_data),
+            ('recipes_delete', user, 'delete',
+             '/api/recipes/{created}/', None),
+            ('ingredients_list', anon, 'get', '/api/ingredients/', None),
+            ('ingredients_search', anon, 'get',
+             '/api/ingredients/?name=%D1%81%D0%BE', None),
+            ('tags_list', anon, 'get', '/api/tags/', None),
+            ('tags_detail', anon, 'get',
+             f'/api/tags/{self.tags[0].id}/', None),
+            ('subscriptions', user, 'get',
+             '/api/users/subscriptions/', None),
+            ('subscriptions_recipes_limit', user, 'get',
+             '/api/users/subscriptions/?recipes_limit=3', None),
+            ('subscriptions_cursor', user, 'get',
+             '/api/users/subscriptions/?cursor=', None),
+            ('feed', user, 'get', '/api/recipes/feed/', None),
+            ('subscribe', user, 'post',
+             f'/api/users/{other_id}/subscribe/', None),
+            ('unsubscribe', user, 'delete',
+             f'/api/users/{other_id}/subscribe/', None),
+            ('favorite_add', user, 'post',
+             f'/api/recipes/{recipe_id}/favorite/', None),
+            ('favorite_delete', user, 'delete',
+             f'/api/recipes/{recipe_id}/favorite/', None),
+            ('shopping_cart_add', user, 'post',
+             f'/api/recipes/{recipe_id}/shopping_cart/', None),
+            ('shopping_cart_delete', user, 'delete',
+             f'/api/recipes/{recipe_id}/shopping_cart/', None),
+            ('download_shopping_cart', user, 'get',
+             '/api/recipes/download_shopping_cart/', None),
+            ('download_shopping_cart_csv', user, 'get',
+             '/api/recipes/download_shopping_cart/?format=csv', None),
+            ('download_shopping_cart_json', user, 'get',
+             '/api/recipes/download_shopping_cart/?format=json', None),
+            ('users_list', user, 'get', '/api/users/', None),
+            ('users_detail', user, 'get', f'/api/users/{author_id}/', None),
+            ('users_me', user, 'get', '/api/users/me/', None),
+            ('users_create', anon, 'post', '/api/users/', {
+                'email': 'new{n}@example.com',
+                'username': 'new{n}',
+                'first_name': 'Новый',
+                'last_name': 'Пользователь',
+                'password': 'Rnd-pass-12345',
+            }),
+            ('token_login', anon, 'post', '/api/auth/token/login/', {
+                'email': 'new{n}@example.com',
+                'password': 'Rnd-pass-12345',
+            }),
+        ]
+
+    def prepare(self, data, n):
+        if data is None:
+            return None
+        return {
+            key: value.format(n=n) if isinstance(value, str) else value
+            for key, value in data.items()
+        }
+
+    def run_cases(self, repeat):
+        """Выполняет сценарии по порядку, повторяя весь набор."""
+        cases = self.get_cases()
+        samples = {name: [] for name, *_ in cases}
+        for n in range(repeat):
+            created = None
+            for name, client, method, url, data in cases:
+                url = url.format(created=created)
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(
+                        url, self.prepare(data, n), format='json')
+                    content = (
+                        b''.join(response.streaming_content)
+                        if response.streaming else response.content)
+                    elapsed = time.perf_counter() - start
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f'{name}: {method.upper()} {url} вернул '
+                        f'{response.status_code}: {content[:200]!r}')
+                if name == 'recipes_create':
+                    created = response.json()['id']
+                samples[name].append(
+                    (len(context.captured_queries), elapsed, len(content)))
+        return {
+            name: {
+                'queries': max(sample[0] for sample in values),
+                'time_ms': round(
+                    statistics.median(sample[1] for sample in values)
+                    * 1000, 2),
+                'size': max(sample[2] for sample in values),
+            } for name, values in samples.items()
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"endpoint":<36}{"queries":>8}{"time, ms":>10}{"size":>10}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<36}{result["queries"]:>8}'
+                f'{result["time_ms"]:>10}{result["size"]:>10}')
+
+    def measurement(self, options, results):
+        return {
+            'scale': options['scale'],
+            'seed': options['seed'],
+            'results': results,
+        }
+
+    def write_json(self, path, data):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+
+    def dump(self, path, options, results):
+        self.write_json(path, {
+            'vendor': connection.vendor,
+            **self.measurement(options, results),
+        })
+
+    def load_baselines(self, path):
+        """Эталоны по СУБД: {connection.vendor: замеры}.
+
+        Число запросов зависит от СУБД (например, оценка count
+        в KeysetPagination делает EXPLAIN только в PostgreSQL), поэтому
+        замеры сравниваются с эталоном, снятым на той же СУБД.
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def update_baseline(self, options, results):
+        baselines = self.load_baselines(options['baseline'])
+        baselines[connection.vendor] = self.measurement(options, results)
+        self.write_json(options['baseline'], baselines)
+
+    def compare(self, results, options):
+        """Список регрессий относительно эталона текущей СУБД."""
+        baseline = self.load_baselines(
+            options['baseline']).get(connection.vendor)
+        if baseline is None:
+            raise CommandError(
+                f'В {options["baseline"]} нет эталона для '
+                f'{connection.vendor}, запустите команду '
+                'с --update-baseline.')
+        if (baseline['scale'], baseline['seed']) != (
+                options['scale'], options['seed']):
+            raise CommandError(
+                'Эталон снят с другими --scale/--seed: '
+                f'{baseline["scale"]}/{baseline["seed"]}.')
+        regressions = []
+        for name, result in results.items():
+            expected = baseline['results'].get(name)
+            if expected is None:
+                regressions.append(f'{name}: нет в эталоне')
+                continue
+            if result['queries'] > expected['queries']:
+                regressions.append(
+                    f'{name}: запросов {result["queries"]} '
+                    f'> {expected["queries"]}')
+            if result['size'] > expected['size'] * (
+                    1 + options['size_tolerance']):
+                regressions.append(
+                    f'{name}: размер {result["size"]} > {expected["size"]}')
+            if result['time_ms'] > max(
+                    expected['time_ms'] * options['time_tolerance'],
+                    expected['time_ms'] + 5):
+                regressions.append(
+                    f'{name}: время {result["time_ms"]} мс '
+                    f'> {expected["time_ms"]} мс')
+        return regressions
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, TimelineEntry)
+from users.models import Follow
+
+
+def first_pair(model, *fields):
+    """Значения полей первой записи, чтобы план строился на живых данных."""
+    return model.objects.values_list(*fields).first() or (1,) * len(fields)
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет EXPLAIN для частых запросов API и проверяет, что они '
+        'используют нужные индексы. Запускается на PostgreSQL после '
+        'generatedata; на маленькой базе используйте --force-index.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force-index', action='store_true',
+            help='Запретить последовательное сканирование (enable_seqscan), '
+                 'чтобы проверить применимость индексов на маленьких '
+                 'таблицах.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(
+                'Проверка планов работает только с PostgreSQL.')
+        failures = []
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+                if options['force_index']:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset, indexes in self.get_queries():
+                plan = queryset.explain()
+                used = [index for index in indexes if index in plan]
+                if used:
+                    self.stdout.write(f'{name}: {", ".join(used)}')
+                else:
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(
+                        f'{name}: не использует {", ".join(indexes)}'))
+                if options['verbosity'] > 1 or not used:
+                    self.stdout.write(plan)
+            transaction.set_rollback(True)
+        if failures:
+            raise CommandError(
+                f'Запросы без нужных индексов: {", ".join(failures)}.')
+        self.stdout.write(
+            self.style.SUCCESS('Все запросы используют индексы.'))
+
+    def get_queries(self):
+        """Название, запрос и индексы, хотя бы один из которых нужен."""
+        favorite_user, favorite_recipe = first_pair(
+            Favorite, 'user_id', 'recipe_id')
+        cart_user, cart_recipe = first_pair(
+            ShoppingCart, 'user_id', 'recipe_id')
+        follower, author = first_pair(Follow, 'user_id', 'author_id')
+        reader, = first_pair(TimelineEntry, 'user_id')
+        recipes = list(Recipe.objects.values_list('id', flat=True)[:6])
+        ingredient = Ingredient.objects.values_list('name', flat=True).first()
+        return (
+            ('is_favorited', Favorite.objects.filter(
+                user_id=favorite_user, recipe_id=favorite_recipe),
+             ('unique_favorite',)),
+            ('is_in_shopping_cart', ShoppingCart.objects.filter(
+                user_id=cart_user, recipe_id=cart_recipe),
+             ('unique_shopping_cart',)),
+            ('is_subscribed', Follow.objects.filter(
+                user_id=follower, author_id=author),
+             ('unique_follow',)),
+            ('filter_is_favorited', Recipe.objects.filter(
+                favorites__user_id=favorite_user),
+             ('unique_favorite',)),
+            ('filter_is_in_shopping_cart', Recipe.objects.filter(
+                shopping_cart__user_id=cart_user),
+             ('unique_shopping_cart',)),
+            ('subscriptions', Follow.objects.filter(user_id=follower),
+             ('unique_follow',)),
+            ('recipe_ingredients', RecipeIngredient.objects.filter(
+                recipe_id__in=recipes or [1]),
+             ('unique_recipe_ingredient',)),
+            ('feed', TimelineEntry.objects.filter(
+                user_id=reader).order_by('-recipe_id')[:10],
+             ('unique_timeline_entry',)),
+            ('ingredient_startswith', Ingredient.objects.filter(
+                name__startswith=(ingredient or 'а')[:2]),
+             ('ingredient_name_like_idx',)),
+        )
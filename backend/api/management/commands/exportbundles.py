@@ -0,0 +1,29 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.bundles import SOURCES, brotli, bundle_store
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает справочники тегов и ингредиентов в JSON со сжатыми '
+        'копиями (.gz, .br) для раздачи через nginx.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=settings.BUNDLES_ROOT,
+            help='Каталог для файлов, по умолчанию BUNDLES_ROOT.')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Укажите --output или BUNDLES_ROOT.')
+        if brotli is None:
+            self.stdout.write(self.style.WARNING(
+                'Пакет brotli не установлен, файлы .br не создаются.'))
+        for name in SOURCES:
+            bundle = bundle_store.get(name)
+            for path in bundle.export(options['output']):
+                self.stdout.write(f'{path}: {os.path.getsize(path)} байт')
+        self.stdout.write(self.style.SUCCESS('Справочники выгружены.'))
@@ -0,0 +1,169 @@
+import asyncio
+import itertools
+import statistics
+import time
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?page=2',
+    '/api/tags/',
+    '/api/ingredients/?name=а',
+)
+
+
+def rss_kb(pids):
+    """Суммарный RSS процессов и всех их потомков в килобайтах."""
+    total = 0
+    pending = list(pids)
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+            with open(f'/proc/{pid}/task/{pid}/children') as children:
+                pending.extend(int(child) for child in children.read().split())
+        except FileNotFoundError:
+            continue
+    return total
+
+
+async def read_response(reader):
+    """Статус и флаг keep-alive ответа HTTP/1.1; тело читается и
+    отбрасывается."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Сервер закрыл соединение.')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection') != 'close'
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест работающего сервера: пропускная способность '
+        'и задержки (p50, p99) GET-запросов. Для сравнения WSGI и ASGI '
+        'запустите оба варианта с одинаковым объёмом памяти (--pid '
+        'выводит RSS процессов сервера) и прогоните тест на каждом.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Адрес сервера, например '
+                                        'http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь запроса, можно указать несколько раз.')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность в секундах.')
+        parser.add_argument('--token', help='Токен для заголовка '
+                                            'Authorization.')
+        parser.add_argument('--pid', type=int, action='append', default=[],
+                            help='PID процесса сервера для замера памяти.')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Нужен адрес вида http://host:port.')
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.paths = [
+            quote(path, safe='/?=&%')
+            for path in options['paths'] or DEFAULT_PATHS]
+        self.headers = f'Host: {url.netloc}\r\n'
+        if options['token']:
+            self.headers += f'Authorization: Token {options["token"]}\r\n'
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+        peak_rss = rss_kb(options['pid'])
+        started = time.monotonic()
+        peak_rss = max(peak_rss, asyncio.run(self.run(
+            options['concurrency'], started + options['duration'],
+            options['pid'])))
+        elapsed = time.monotonic() - started
+        self.report(elapsed, peak_rss if options['pid'] else None)
+
+    async def run(self, concurrency, deadline, pids):
+        paths = itertools.cycle(self.paths)
+        workers = [
+            asyncio.create_task(self.worker(paths, deadline))
+            for _ in range(concurrency)
+        ]
+        peak_rss = 0
+        while not all(worker.done() for worker in workers):
+            if pids:
+                peak_rss = max(peak_rss, rss_kb(pids))
+            await asyncio.sleep(0.5)
+        return peak_rss
+
+    async def worker(self, paths, deadline):
+        reader = writer = None
+        while time.monotonic() < deadline:
+            if writer is None:
+                try:
+                    reader, writer = await asyncio.open_connection(
+                        self.host, self.port)
+                except OSError:
+                    self.errors += 1
+                    await asyncio.sleep(0.1)
+                    continue
+            request = f'GET {next(paths)} HTTP/1.1\r\n{self.headers}\r\n'
+            started = time.perf_counter()
+            try:
+                writer.write(request.encode())
+                await writer.drain()
+                status, keep_alive = await read_response(reader)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError,
+                    ValueError, IndexError):
+                self.errors += 1
+                writer.close()
+                writer = None
+                continue
+            self.latencies.append(time.perf_counter() - started)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if not keep_alive:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    def report(self, elapsed, peak_rss):
+        if not self.latencies:
+            raise CommandError(f'Нет ответов, ошибок: {self.errors}.')
+        latencies = sorted(self.latencies)
+        percentile = statistics.quantiles(latencies, n=100)
+        lines = [
+            f'Запросов: {len(latencies)} за {elapsed:.1f} с, '
+            f'{len(latencies) / elapsed:.1f} в секунду',
+            f'p50 {percentile[49] * 1000:.1f} мс, '
+            f'p99 {percentile[98] * 1000:.1f} мс, '
+            f'максимум {latencies[-1] * 1000:.1f} мс',
+            'Статусы: ' + ', '.join(
+                f'{status}: {count}'
+                for status, count in sorted(self.statuses.items())),
+            f'Ошибок соединения: {self.errors}',
+        ]
+        if peak_rss is not None:
+            lines.append(f'Пиковый RSS сервера: {peak_rss / 1024:.0f} МБ')
+        self.stdout.write('\n'.join(lines))
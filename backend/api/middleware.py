@@ -0,0 +1,281 @@
+import collections
+import contextlib
+import json
+import logging
+import random
+import re
+import time
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('api.profiling')
+
+IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+NUMBER = re.compile(r'\b\d+\b')
+SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """SQL без конкретных значений: списки IN и числа схлопываются.
+
+    Запросы, отличающиеся только параметрами, получают один отпечаток,
+    поэтому повторы одного отпечатка в запросе - признак N+1.
+    """
+    sql = IN_LIST.sub('(...)', sql)
+    sql = NUMBER.sub('N', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+class QueryLog:
+    """Запросы к базе за время обработки одного HTTP-запроса."""
+
+    def __init__(self, keep_sql):
+        self.keep_sql = keep_sql
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+        self.fingerprints = collections.Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            self.fingerprints[fingerprint(sql)] += 1
+            if self.keep_sql:
+                self.queries.append({
+                    'alias': context['connection'].alias,
+                    'sql': sql,
+                    'ms': round(duration * 1000, 2),
+                })
+
+    def repeated(self):
+        """Отпечатки, выполненные не меньше PROFILING_REPEAT_THRESHOLD раз."""
+        return [
+            {'fingerprint': sql, 'count': count}
+            for sql, count in self.fingerprints.most_common()
+            if count >= settings.PROFILING_REPEAT_THRESHOLD
+        ]
+
+
+@contextlib.contextmanager
+def profile_queries(request):
+    """Пишет запросы соединений текущего потока в журнал HTTP-запроса.
+
+    Без профилирования (нет request.query_log) ничего не делает.
+    """
+    queries = getattr(request, 'query_log', None)
+    with contextlib.ExitStack() as stack:
+        if queries is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+        yield
+
+
+@contextlib.contextmanager
+def profile_serialization(request):
+    """Время блока идёт в замер serialize профилируемого запроса.
+
+    Запросы к базе внутри блока остаются в замере db. Вложенные блоки
+    (сериализатор внутри сериализатора) отдельно не учитываются.
+    request - HttpRequest или Request DRF; без профилирования ничего
+    не делает.
+    """
+    request = getattr(request, '_request', request)
+    queries = getattr(request, 'query_log', None)
+    if queries is None or getattr(request, 'serializing', False):
+        yield
+        return
+    request.serializing = True
+    started, db = time.perf_counter(), queries.duration
+    try:
+        yield
+    finally:
+        request.serializing = False
+        request.serialize_duration = (
+            getattr(request, 'serialize_duration', 0.0)
+            + time.perf_counter() - started - (queries.duration - db))
+
+
+class QueryProfilingMiddleware:
+    """Профилирование запросов к базе и времени обработки.
+
+    При PROFILING_SERVER_TIMING ответ получает заголовок Server-Timing:
+    время в базе и число запросов (db), сериализацию (serialize), время
+    вьюхи без базы и сериализации (app), отрисовку ответа (render)
+    и общее время (total).
+    Доля PROFILING_SAMPLE_RATE запросов профилируется с текстом SQL;
+    если такой запрос дольше PROFILING_SLOW_MS или повторяет один
+    и тот же SQL, в лог api.profiling пишется JSON-запись.
+    Запросы без профилирования обрабатываются без обёрток.
+
+    Границы замеров:
+    - serialize - время to_representation сериализаторов
+      с ProfiledSerializerMixin (api.serializers) без их запросов
+      к базе; сериализаторы без него остаются в app, а render - только
+      перевод готовых данных в байты;
+    - тело потокового ответа формируется после отправки заголовков,
+      поэтому его запросы и время в Server-Timing не попадают; они
+      учитываются в записи лога, которая пишется после отправки тела;
+    - под ASGI запросы к базе учитываются в потоке, где Django
+      выполняет синхронный код запроса (вьюхи, сериализаторы, ORM
+      через sync_to_async); запросы из других потоков и пулов, например
+      фоновой обработки изображений и лент, не учитываются.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            # Синхронные хуки Django вызывал бы через общий поток.
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.start(request):
+            return self.get_response(request)
+        with profile_queries(request):
+            response = self.get_response(request)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        if not self.start(request):
+            return await self.get_response(request)
+        # Соединения с базой у каждого потока свои, а синхронный код
+        # запроса Django выполняет в одном потоке на запрос: обёртки
+        # ставятся и снимаются в нём.
+        profiling = contextlib.ExitStack()
+        await sync_to_async(profiling.enter_context)(
+            profile_queries(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(profiling.close)()
+        return self.finish(request, response)
+
+    def start(self, request):
+        """Решает, профилировать ли запрос, и заводит для него журнал."""
+        sampled = random.random() < settings.PROFILING_SAMPLE_RATE
+        if not (sampled or settings.PROFILING_SERVER_TIMING):
+            return False
+        request.query_log = QueryLog(keep_sql=sampled)
+        request.profile_marks = {'start': time.perf_counter()}
+        return True
+
+    def finish(self, request, response):
+        queries = request.query_log
+        if settings.PROFILING_SERVER_TIMING:
+            response['Server-Timing'] = self.server_timing(
+                self.get_timings(request, queries), queries,
+                queries.repeated())
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.profile_stream(
+                request, response, response.streaming_content)
+        else:
+            self.report(request, response)
+        return response
+
+    def profile_stream(self, request, response, content):
+        """Тело потокового ответа с учётом его запросов к базе.
+
+        Запись в лог делается, когда тело отправлено или ответ закрыт.
+        """
+        try:
+            with profile_queries(request):
+                yield from content
+        finally:
+            self.report(request, response)
+
+    def report(self, request, response):
+        """Пишет в лог медленный или повторяющий SQL запрос."""
+        queries = request.query_log
+        if not queries.keep_sql:
+            return
+        timings = self.get_timings(request, queries)
+        repeated = queries.repeated()
+        if timings['total'] >= settings.PROFILING_SLOW_MS or repeated:
+            self.log(request, response, timings, queries, repeated)
+
+    def mark(self, request, name):
+        if hasattr(request, 'profile_marks'):
+            request.profile_marks[name] = time.perf_counter()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.mark(request, 'view')
+
+    def process_template_response(self, request, response):
+        self.mark(request, 'render')
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args,
+                            view_kwargs):
+        self.mark(request, 'view')
+
+    async def aprocess_template_response(self, request, response):
+        self.mark(request, 'render')
+        return response
+
+    def get_timings(self, request, queries):
+        """Длительности в миллисекундах.
+
+        Время render есть только у отложенно отрисовываемых ответов,
+        в том числе у ответов DRF.
+        """
+        finished = time.perf_counter()
+        marks = request.profile_marks
+        started = marks['start']
+        view = marks.get('view', started)
+        render = marks.get('render', finished)
+        serialize = getattr(request, 'serialize_duration', 0.0)
+        timings = {
+            'db': queries.duration * 1000,
+            'serialize': serialize * 1000,
+            'app': max(
+                (render - view - queries.duration - serialize) * 1000, 0),
+            'render': (finished - render) * 1000,
+            'total': (finished - started) * 1000,
+        }
+        return {name: round(value, 2) for name, value in timings.items()}
+
+    def server_timing(self, timings, queries, repeated):
+        description = f'{queries.count} queries'
+        if repeated:
+            description += f', {len(repeated)} repeated'
+        return ', '.join([
+            f'db;dur={timings["db"]};desc="{description}"',
+            f'serialize;dur={timings["serialize"]}',
+            f'app;dur={timings["app"]}',
+            f'render;dur={timings["render"]}',
+            f'total;dur={timings["total"]}',
+        ])
+
+    def get_user_id(self, request):
+        """pk уже известного пользователя.
+
+        Ленивый пользователь сессии не загружается: в асинхронном режиме
+        это запрос к базе из цикла событий.
+        """
+        user = request.__dict__.get('user')
+        return getattr(getattr(user, '_wrapped', user), 'pk', None)
+
+    def log(self, request, response, timings, queries, repeated):
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user': self.get_user_id(request),
+            'timings': timings,
+            'query_count': queries.count,
+            'repeated': repeated,
+            'queries': queries.queries,
+        }, ensure_ascii=False))
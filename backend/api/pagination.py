@@ -0,0 +1,162 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db import connections
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """Оценка количества строк по плану запроса PostgreSQL.
+
+    Вместо COUNT(*) выполняется только EXPLAIN, поэтому стоимость
+    не зависит от объёма выборки. Для других СУБД возвращает None.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.get_compiler(
+        using=queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация по первичному ключу без COUNT и OFFSET."""
+    ordering = '-id'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class CursorOptInPagination(PageNumberPagination):
+    """Постраничная пагинация с курсорным режимом по запросу.
+
+    Если в запросе есть параметр cursor (для первой страницы - пустой),
+    используется KeysetPagination: страницы упорядочены по -id, а count
+    содержит оценку планировщика. Иначе работает обычная PageNumberPagination.
+    Курсор не сочетается с параметрами своего порядка (ordered_query_params):
+    поиск по релевантности или ordering курсор по -id молча отбросил бы,
+    поэтому такой запрос получает 400.
+    """
+    ordered_query_params = ('search', 'ordering')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.is_keyset(request):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() на асинхронном ORM для api.async_views.
+
+        Курсорный режим синхронный: его запросы выполняются в потоке.
+        """
+        self.keyset = None
+        if self.is_keyset(request):
+            return await sync_to_async(self.paginate_queryset)(
+                queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return [obj async for obj in self.page.object_list]
+
+    def is_keyset(self, request):
+        """Запрошен ли курсорный режим; конфликт параметров - 400."""
+        cursor = KeysetPagination.cursor_query_param
+        if cursor in request.query_params:
+            conflicting = [
+                param for param in self.ordered_query_params
+                if request.query_params.get(param, '').strip()
+            ]
+            if conflicting:
+                raise ValidationError({cursor: (
+                    f'Курсор упорядочен по -id и не сочетается '
+                    f'с параметрами: {", ".join(conflicting)}.')})
+            return True
+        return False
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FeedPagination(BasePagination):
+    """Пагинация ленты по id рецепта без COUNT и OFFSET.
+
+    Следующая страница - рецепты с id меньше последнего на текущей
+    (параметр before), размер страницы задаётся параметром limit.
+    """
+    before_query_param = 'before'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        if page_size < 1:
+            return api_settings.PAGE_SIZE
+        return min(page_size, self.max_page_size)
+
+    def get_before(self, request):
+        before = request.query_params.get(self.before_query_param)
+        if before is None:
+            return None
+        try:
+            return int(before)
+        except ValueError:
+            raise ValidationError(
+                {self.before_query_param: 'Ожидается id рецепта.'})
+
+    def paginate_feed(self, feed, request):
+        """id рецептов страницы; feed(before, limit) возвращает id ленты."""
+        self.request = request
+        page_size = self.get_page_size(request)
+        ids = feed(before=self.get_before(request), limit=page_size)
+        self.next_before = ids[-1] if len(ids) == page_size else None
+        return ids
+
+    def get_next_link(self):
+        if self.next_before is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.before_query_param, self.next_before)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
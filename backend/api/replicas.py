@@ -0,0 +1,159 @@
+import contextlib
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_KEY = 'replica:pin:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+routing = contextvars.ContextVar('replica_routing', default=None)
+force_primary = contextvars.ContextVar('replica_force_primary', default=False)
+
+
+class RequestRouting:
+    """Состояние маршрутизации запросов к базе одного HTTP-запроса."""
+
+    def __init__(self, request):
+        self.request = request
+        self.read_only = request.method in SAFE_METHODS
+        self.replica = None
+        self.pinned = None
+
+    def get_user_id(self):
+        """pk пользователя, если он уже определён.
+
+        DRF после аутентификации записывает пользователя и в исходный
+        HttpRequest. Ленивый пользователь сессии здесь не загружается:
+        это был бы запрос к базе изнутри роутера.
+        """
+        user = self.request.__dict__.get('user')
+        return getattr(getattr(user, '_wrapped', user), 'pk', None)
+
+    def is_pinned(self):
+        """Писал ли пользователь в базу последние REPLICA_PIN_SECONDS.
+
+        Пока пользователь не определён, ответ не запоминается.
+        """
+        if self.pinned is None:
+            user_id = self.get_user_id()
+            if user_id is None:
+                return False
+            self.pinned = bool(cache.get(PIN_KEY.format(user_id)))
+        return self.pinned
+
+    def get_replica(self):
+        if self.replica is None:
+            self.replica = random.choice(settings.DATABASE_REPLICAS)
+        return self.replica
+
+
+@contextlib.contextmanager
+def use_primary():
+    """Все чтения внутри блока идут в основную базу.
+
+    Нужно там, где прочитанное сохраняется в кеш с ключом из версий
+    данных (recipes.versions): реплика, отстающая от только что
+    увеличенной версии, записала бы под новой версией старые данные.
+    """
+    token = force_primary.set(True)
+    try:
+        yield
+    finally:
+        force_primary.reset(token)
+
+
+class ReplicaRouter:
+    """Чтение безопасных HTTP-запросов с реплик, запись в основную базу.
+
+    Реплики перечислены в DATABASE_REPLICAS. С реплики читаются только
+    запросы GET, HEAD и OPTIONS, прошедшие через ReplicaMiddleware;
+    команды, фоновые задачи и изменяющие запросы работают с основной
+    базой. Пользователь, недавно писавший в базу, читает из основной
+    базы, чтобы сразу видеть свои изменения.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = routing.get()
+        if (
+            state is None or not state.read_only
+            or not settings.DATABASE_REPLICAS or force_primary.get()
+        ):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if (
+            connections[DEFAULT_DB_ALIAS].in_atomic_block
+            or state.is_pinned()
+        ):
+            return DEFAULT_DB_ALIAS
+        return state.get_replica()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """Заводит состояние маршрутизации на время обработки запроса.
+
+    После успешного изменяющего запроса (POST, PUT, PATCH, DELETE)
+    пользователь на REPLICA_PIN_SECONDS закрепляется за основной базой.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RequestRouting(request)
+        token = routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing.reset(token)
+        key = self.get_pin_key(state, response)
+        if key is not None:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        state = RequestRouting(request)
+        token = routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing.reset(token)
+        key = self.get_pin_key(state, response)
+        if key is not None:
+            await cache.aset(key, True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    def get_pin_key(self, state, response):
+        """Ключ закрепления, если известный пользователь мог изменить
+        данные."""
+        if state.read_only or response.status_code >= 400:
+            return None
+        user_id = state.get_user_id()
+        if user_id is None:
+            return None
+        return PIN_KEY.format(user_id)
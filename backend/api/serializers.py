@@ -1,21 +1,109 @@
 from rest_framework import serializers
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
-from django.shortcuts import get_object_or_404
+from django.core.files.storage import default_storage
+from django.db import transaction
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingList, Tag)
 from users.models import Follow, User
 
-
-def create_ingredients_in_recipe(ingredients, instance):
-    RecipeIngredient.objects.bulk_create(
-        [RecipeIngredient(
-            ingredient=get_object_or_404(Ingredient,
-                                         id=ingredient['ingredient']['id']),
-            recipe=instance,
-            amount=ingredient['amount']
-        ) for ingredient in ingredients]
-    )
+from .middleware import profile_serialization
+
+
+def get_amounts(ingredients):
+    """Проверенные ингредиенты в виде {id ингредиента: количество}."""
+    return {
+        ingredient['ingredient']['id']: ingredient['amount']
+        for ingredient in ingredients
+    }
+
+
+def set_ingredients_in_recipe(instance, amounts):
+    """Приводит состав рецепта к amounts минимальным числом запросов.
+
+    Возвращает прежний состав {id ингредиента: количество}.
+    """
+    current = {
+        row.ingredient_id: row
+        for row in RecipeIngredient.objects.filter(recipe=instance)
+    }
+    old_amounts = {
+        ingredient_id: row.amount for ingredient_id, row in current.items()
+    }
+    removed = current.keys() - amounts.keys()
+    if removed:
+        RecipeIngredient.objects.filter(
+            recipe=instance, ingredient_id__in=removed).delete()
+    changed = []
+    for ingredient_id, amount in amounts.items():
+        row = current.get(ingredient_id)
+        if row is not None and row.amount != amount:
+            row.amount = amount
+            changed.append(row)
+    if changed:
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+    added = amounts.keys() - current.keys()
+    if added:
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=instance,
+                ingredient_id=ingredient_id,
+                amount=amounts[ingredient_id],
+            ) for ingredient_id in added)
+    return old_amounts
+
+
+def get_recipes_limit(request):
+    """Значение recipes_limit из запроса или None, если не задано."""
+    if request is None:
+        return None
+    try:
+        limit = int(request.query_params.get('recipes_limit', ''))
+    except ValueError:
+        return None
+    return limit if limit > 0 else None
+
+
+class ProfiledSerializerMixin:
+    """Время сериализации идёт в замер serialize профилирования.
+
+    Списки (many=True) учитываются по элементам: ListSerializer
+    вызывает to_representation дочернего сериализатора.
+    """
+
+    def to_representation(self, instance):
+        with profile_serialization(self.context.get('request')):
+            return super().to_representation(instance)
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии изображения: {размер: {формат: url}}.
+
+    Пока копии не готовы, возвращается пустой словарь, и клиент
+    использует исходное изображение из поля image.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        variants = recipe.image_variants
+        if not recipe.image or variants.get('source') != recipe.image.name:
+            return {}
+        request = self.context.get('request')
+        result = {}
+        for size, files in variants.items():
+            if size == 'source':
+                continue
+            result[size] = {}
+            for image_format, name in files.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                result[size][image_format] = url
+        return result
 
 
 class UserCreateSerializer(UserSerializer):
@@ -31,14 +119,38 @@ class UserCreateSerializer(UserSerializer):
         ]
 
 
-class TagSerializer(serializers.ModelSerializer):
+class UserSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    """Сериализатор для пользователя."""
+    is_subscribed = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['email',
+                  'id',
+                  'username',
+                  'first_name',
+                  'last_name',
+                  'is_subscribed'
+                  ]
+
+    def get_is_subscribed(self, obj):
+        request = self.context.get('request')
+        if request.user.is_anonymous:
+            return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return request.user.follower.filter(author=obj).exists()
+
+
+class TagSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для тегов."""
     class Meta:
         model = Tag
         fields = ['id', 'name', 'color', 'slug']
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(ProfiledSerializerMixin,
+                           serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
@@ -59,13 +171,14 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'measurement_unit', 'amount']
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для рецептов."""
     tags = TagSerializer(many=True)
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(many=True,)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -78,6 +191,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time'
         ]
@@ -86,12 +200,16 @@ class RecipeSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return request.user.favorites.filter(recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return request.user.shopping_cart.filter(recipe=obj).exists()
 
 
@@ -117,6 +235,7 @@ class RecipeCreateSerializer(RecipeSerializer):
     image = Base64ImageField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
     cooking_time = serializers.IntegerField()
 
     class Meta:
@@ -130,21 +249,24 @@ class RecipeCreateSerializer(RecipeSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time'
         ]
 
+    @transaction.atomic
     def create(self, validated_data):
-        ingredients = validated_data.pop('ingredients')
+        amounts = get_amounts(validated_data.pop('ingredients'))
         instance = super().create(validated_data)
-        create_ingredients_in_recipe(ingredients, instance)
+        set_ingredients_in_recipe(instance, amounts)
         return instance
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        RecipeIngredient.objects.filter(recipe=instance).delete()
+        amounts = get_amounts(validated_data.pop('ingredients'))
         super().update(instance, validated_data)
-        create_ingredients_in_recipe(ingredients, instance)
+        old_amounts = set_ingredients_in_recipe(instance, amounts)
+        ShoppingList.objects.update_recipe(instance.id, old_amounts, amounts)
         return instance
 
     def validate_cooking_time(self, cooking_time):
@@ -153,12 +275,19 @@ class RecipeCreateSerializer(RecipeSerializer):
                 'Время готовки не может быть меньше 1 минуты')
         return cooking_time
 
-    # def validate_ingredients(self, ingredients):
-        # for ingredient in ingredients:
-        # if int(ingredient.get('amount')) < 1:
-        # raise serializers.ValidationError(
-        # 'Количество ингредиента не может быть 0!')
-        # return ingredients
+    def validate_ingredients(self, ingredients):
+        """Все ингредиенты проверяются одним запросом."""
+        ids = [ingredient['ingredient']['id'] for ingredient in ingredients]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты в рецепте не должны повторяться!')
+        missing = set(ids) - set(Ingredient.objects.filter(
+            id__in=ids).values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: '
+                f'{", ".join(map(str, sorted(missing)))}')
+        return ingredients
 
     def validate(self, attrs):
         ingredients = attrs['ingredients']
@@ -169,28 +298,7 @@ class RecipeCreateSerializer(RecipeSerializer):
         return attrs
 
 
-class UserSerializer(serializers.ModelSerializer):
-    """Сериализатор для пользователя."""
-    is_subscribed = serializers.SerializerMethodField(read_only=True)
-
-    class Meta:
-        model = User
-        fields = ['email',
-                  'id',
-                  'username',
-                  'first_name',
-                  'last_name',
-                  'is_subscribed'
-                  ]
-
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request.user.is_anonymous:
-            return False
-        return request.user.follower.filter(author=obj).exists()
-
-
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для добавления в избранное."""
     id = serializers.CharField(source='recipe.id')
     name = serializers.CharField(source='recipe.name')
@@ -202,7 +310,7 @@ class FavoriteSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для подписок."""
     id = serializers.IntegerField(
         source='author.id')
@@ -216,7 +324,8 @@ class FollowSerializer(serializers.ModelSerializer):
         source='author.last_name')
     recipes = serializers.SerializerMethodField()
     is_subscribed = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.IntegerField(
+        source='author.recipes_count', read_only=True)
 
     class Meta:
         model = Follow
@@ -227,26 +336,31 @@ class FollowSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
-        return Follow.objects.filter(
-            author__following__user=request.user).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return request.user.follower.filter(author=obj.author).exists()
 
     def get_recipes(self, obj):
-        recipes = obj.author.recipes.all()
-        return FollowRecipeSerializer(recipes, many=True).data
-
-    def get_recipes_count(self, obj):
-        return obj.author.recipes.all().count()
+        if hasattr(obj.author, 'subscription_recipes'):
+            recipes = obj.author.subscription_recipes
+        else:
+            recipes = obj.author.recipes.all()[:get_recipes_limit(
+                self.context.get('request'))]
+        return FollowRecipeSerializer(
+            recipes, many=True, context=self.context).data
 
 
 class FollowRecipeSerializer(serializers.ModelSerializer):
     """Связь подписчика и рецепта."""
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(ProfiledSerializerMixin,
+                             serializers.ModelSerializer):
     """Сериализатор для корзины."""
     name = serializers.CharField()
     image = serializers.ImageField()
@@ -255,3 +369,39 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShoppingCart
         fields = ('id', 'name', 'image', 'cooking_time')
+
+
+class RecipeImportIngredientSerializer(serializers.Serializer):
+    """Ингредиент рецепта при импорте: название, единица и количество."""
+    name = serializers.CharField(max_length=200)
+    measurement_unit = serializers.CharField(max_length=120)
+    amount = serializers.IntegerField(min_value=1)
+
+
+class RecipeImportSerializer(serializers.Serializer):
+    """Строка NDJSON-импорта рецептов.
+
+    Теги задаются слагами, ингредиенты - парой название и единица
+    измерения, автор - почтой, изображение - base64 или именем файла,
+    уже лежащего в хранилище. Существование тегов, ингредиентов
+    и авторов проверяется сразу для всей пачки строк в api.bulk.
+    """
+    author = serializers.EmailField(required=False)
+    name = serializers.CharField(max_length=200)
+    text = serializers.CharField()
+    cooking_time = serializers.IntegerField(min_value=1)
+    image = serializers.CharField()
+    tags = serializers.ListField(
+        child=serializers.SlugField(), allow_empty=False)
+    ingredients = RecipeImportIngredientSerializer(
+        many=True, allow_empty=False)
+
+    def validate_ingredients(self, ingredients):
+        keys = [
+            (ingredient['name'], ingredient['measurement_unit'])
+            for ingredient in ingredients
+        ]
+        if len(set(keys)) != len(keys):
+            raise serializers.ValidationError(
+                'Ингредиенты в рецепте не должны повторяться!')
+        return ingredients
@@ -0,0 +1,53 @@
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+from .authentication import token_cache
+from .bundles import SOURCES, bundle_store
+
+
+def export_bundle(name):
+    bundle_store.build(name).export(settings.BUNDLES_ROOT)
+
+
+def schedule_bundle_export(sender, **kwargs):
+    """Перевыгружает справочник на диск после фиксации изменений."""
+    if not settings.BUNDLES_ROOT:
+        return
+    for name, (model, _) in SOURCES.items():
+        if model is sender:
+            transaction.on_commit(partial(export_bundle, name))
+
+
+for model, _ in SOURCES.values():
+    post_save.connect(schedule_bundle_export, sender=model)
+    post_delete.connect(schedule_bundle_export, sender=model)
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_tokens(sender, instance, update_fields=None, **kwargs):
+    """Сбрасывает кеш токенов при изменении пользователя.
+
+    Сохранение одного last_login при входе кеш не затрагивает.
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def forget_logged_out(sender, user, **kwargs):
+    if user is not None:
+        token_cache.invalidate_user(user.pk)
@@ -0,0 +1,218 @@
+import contextlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+from rest_framework.throttling import ScopedRateThrottle
+
+IN_FLIGHT_KEY = 'in-flight:{}'
+BUCKET_LOCK_KEY = '{}:lock'
+BUCKET_LOCK_TIMEOUT = 1
+BUCKET_LOCK_ATTEMPTS = 20
+BUCKET_LOCK_DELAY = 0.005
+
+
+def get_scope(view):
+    """Область ограничений вьюхи: по действию вьюсета из throttle_scopes
+    или общая throttle_scope."""
+    scopes = getattr(view, 'throttle_scopes', {})
+    return scopes.get(getattr(view, 'action', None),
+                      getattr(view, 'throttle_scope', None))
+
+
+class TokenBucketThrottle(ScopedRateThrottle):
+    """Ограничение частоты запросов по алгоритму token bucket.
+
+    Скорость задаётся для области в DEFAULT_THROTTLE_RATES в формате DRF
+    ('20/min'): ведро вмещает 20 запросов и пополняется равномерно,
+    по одному запросу за 3 секунды. Ведро своё у каждого пользователя,
+    у анонимных - у каждого IP. Вьюхи без области или области без
+    скорости не ограничиваются. Состояние хранится в кеше
+    THROTTLE_CACHE_ALIAS: LocMemCache считает запросы в процессе,
+    общий кеш - по всем процессам. Чтение и запись ведра выполняются
+    под блокировкой в том же кеше, иначе одновременные запросы
+    пользователя тратили бы один и тот же запрос из ведра. Блокировка
+    строгая там, где атомарен cache.add (Redis, Memcached, LocMemCache);
+    файловый кеш даёт лишь приблизительное ограничение.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.THROTTLE_CACHE_ALIAS]
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Блокировка ведра на cache.add; выдаёт False, если ведро
+        так и не удалось захватить."""
+        lock = BUCKET_LOCK_KEY.format(self.key)
+        for _ in range(BUCKET_LOCK_ATTEMPTS):
+            if self.cache.add(lock, True, BUCKET_LOCK_TIMEOUT):
+                break
+            time.sleep(BUCKET_LOCK_DELAY)
+        else:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.cache.delete(lock)
+
+    def allow_request(self, request, view):
+        self.scope = get_scope(view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(rate)
+        self.key = self.get_cache_key(request, view)
+        with self.locked() as acquired:
+            self.now = self.timer()
+            if not acquired:
+                # Ведро занято другими запросами того же пользователя
+                # дольше, чем длятся их проверки: ответить как при
+                # пустом ведре.
+                self.tokens = 0
+                return self.throttle_failure()
+            tokens, updated = self.cache.get(
+                self.key, (self.num_requests, self.now))
+            self.tokens = min(
+                self.num_requests,
+                tokens + (self.now - updated)
+                * self.num_requests / self.duration)
+            if self.tokens < 1:
+                return self.throttle_failure()
+            self.cache.set(
+                self.key, (self.tokens - 1, self.now), self.duration)
+        return self.throttle_success()
+
+    def throttle_success(self):
+        return True
+
+    def wait(self):
+        """Секунды до появления в ведре следующего запроса."""
+        return (1 - self.tokens) * self.duration / self.num_requests
+
+
+class Overloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервер перегружен, повторите запрос позже.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait):
+        super().__init__()
+        # Обработчик исключений DRF переносит wait в Retry-After.
+        self.wait = wait
+
+
+class ConcurrencyLimiter:
+    """Число одновременно выполняемых запросов каждой области.
+
+    По умолчанию счётчик хранится в общем кеше CONCURRENCY_CACHE_ALIAS
+    и один на все процессы: синхронный worker gunicorn выполняет
+    один запрос за раз, и счётчик в его памяти ничего бы не ограничивал.
+    Счётчик приблизителен: ключ живёт CONCURRENCY_TIMEOUT секунд,
+    поэтому запросы упавшего процесса не занимают места вечно.
+    С пустым CONCURRENCY_CACHE_ALIAS запросы считаются в памяти
+    процесса (worker с потоками).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = Counter()
+
+    @property
+    def shared(self):
+        alias = settings.CONCURRENCY_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def acquire(self, scope, limit):
+        shared = self.shared
+        if shared is None:
+            with self.lock:
+                if self.in_flight[scope] >= limit:
+                    return False
+                self.in_flight[scope] += 1
+                return True
+        key = IN_FLIGHT_KEY.format(scope)
+        shared.add(key, 0, settings.CONCURRENCY_TIMEOUT)
+        try:
+            count = shared.incr(key)
+        except ValueError:
+            shared.add(key, 1, settings.CONCURRENCY_TIMEOUT)
+            return True
+        if count > limit:
+            self.release(scope)
+            return False
+        return True
+
+    def release(self, scope):
+        shared = self.shared
+        if shared is None:
+            with self.lock:
+                self.in_flight[scope] -= 1
+            return
+        try:
+            shared.decr(IN_FLIGHT_KEY.format(scope))
+        except ValueError:
+            pass
+
+
+concurrency_limiter = ConcurrencyLimiter()
+
+
+class ReleasingContent:
+    """Потоковое тело ответа, освобождающее место при закрытии ответа."""
+
+    def __init__(self, content, release):
+        self.content = content
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def close(self):
+        self.release()
+
+
+class ConcurrencyLimitMixin:
+    """Ограничение одновременных запросов областей из CONCURRENCY_LIMITS.
+
+    Область определяется так же, как для TokenBucketThrottle. Сверх
+    лимита запрос сразу получает 503 с Retry-After, не занимая worker
+    на долгую работу. Место освобождается, когда ответ отправлен,
+    у потоковых ответов - после отправки всего тела.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        scope = get_scope(self)
+        limit = settings.CONCURRENCY_LIMITS.get(scope)
+        if limit is None:
+            return
+        if not concurrency_limiter.acquire(scope, limit):
+            raise Overloaded(settings.CONCURRENCY_RETRY_AFTER)
+        self.admitted_scope = scope
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        scope = self.__dict__.pop('admitted_scope', None)
+        if scope is None:
+            return response
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                concurrency_limiter.release(scope)
+
+        if response.streaming:
+            response.streaming_content = ReleasingContent(
+                response.streaming_content, release)
+        else:
+            release()
+        return response
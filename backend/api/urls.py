@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from .views import (Favorite, FollowersViewSet, Follows,
@@ -12,11 +13,18 @@ router.register('tags', TagViewSet, basename='tags')
 router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 
+router_urls = router.urls
+subscriptions = FollowersViewSet.as_view()
+if settings.ASYNC_READ_VIEWS:
+    from .async_views import async_view, asyncify
+    router_urls = asyncify(router_urls)
+    subscriptions = async_view(subscriptions)
+
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(router_urls)),
     path(
         'users/subscriptions/',
-        FollowersViewSet.as_view(),
+        subscriptions,
         name='subscriptions'),
     path(
         'users/<int:user_id>/subscribe/',
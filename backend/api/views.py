@@ -1,39 +1,156 @@
+import functools
+
 from rest_framework import generics, status
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponse
-from django.db.models import Sum
-from recipes.models import (Ingredient, Recipe, Tag,)
+from django.http import StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Value, Window
+from django.db.models.functions import RowNumber
+from recipes.models import (Favorite as FavoriteModel, Ingredient, Recipe,
+                            ShoppingCart as ShoppingCartModel, Tag,
+                            TimelineEntry)
+from recipes.versions import get_user_version
 from users.models import Follow, User
 
 from .serializers import (FavoriteSerializer, FollowSerializer,
                           IngredientSerializer, RecipeCreateSerializer,
                           RecipeIngredient, RecipeSerializer,
-                          ShoppingCartSerializer, TagSerializer)
+                          ShoppingCartSerializer, TagSerializer,
+                          get_recipes_limit)
+from .async_views import AsyncReadMixin
+from .bulk import RecipeImporter, export_recipes
+from .bundles import bundle_response, bundle_store
+from .caching import VersionedCacheMixin
 from .filters import IngredientFilter, RecipeFilter
+from .ingredient_index import ingredient_index
+from .pagination import CursorOptInPagination, FeedPagination
 from .permissions import IsAuthorPermissions
+from .renderers import (ShoppingCartCSVRenderer, ShoppingCartJSONRenderer,
+                        ShoppingCartTextRenderer)
+from .replicas import use_primary
+from .throttling import ConcurrencyLimitMixin
+
+SHOPPING_CART_CHUNK_SIZE = 500
 
 
-class TagViewSet(ModelViewSet):
+class TagViewSet(VersionedCacheMixin, AsyncReadMixin, ModelViewSet):
     """Вьюсет для тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    cache_models = (Tag,)
+    async_actions = ('retrieve',)
 
+    def list(self, request, *args, **kwargs):
+        """Список тегов из готового сжатого бандла."""
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        return bundle_response(request, bundle_store.get('tags'))
 
-class RecipeViewSet(ModelViewSet):
+
+class RecipeViewSet(ConcurrencyLimitMixin, VersionedCacheMixin,
+                    AsyncReadMixin, ModelViewSet):
     """Вьюсет для рецептов."""
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     filter_backends = [DjangoFilterBackend, ]
-    pagination_class = PageNumberPagination
+    pagination_class = CursorOptInPagination
     filterset_class = RecipeFilter
     permission_classes = [IsAuthorPermissions, ]
+    cache_models = (Recipe, Tag, Ingredient, User)
+    personal_query_params = ('is_favorited', 'is_in_shopping_cart')
+    throttle_scopes = {
+        'create': 'recipe_write',
+        'update': 'recipe_write',
+        'partial_update': 'recipe_write',
+        'download_shopping_cart': 'shopping_cart',
+        'export': 'bulk',
+        'import_recipes': 'bulk',
+    }
+
+    def get_queryset(self):
+        """Рецепты с предзагрузкой связей и флагами текущего пользователя."""
+        user = self.request.user
+        queryset = Recipe.objects.prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')),
+        )
+        if user.is_anonymous:
+            return queryset.select_related('author')
+        authors = User.objects.annotate(is_subscribed=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('pk'))))
+        return queryset.prefetch_related(
+            Prefetch('author', authors)
+        ).annotate(
+            is_favorited=Exists(FavoriteModel.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCartModel.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    def is_personal(self, request):
+        return request.user.is_authenticated
+
+    def get_etag(self, request, key):
+        """ETag с учётом версии избранного, корзины и подписок."""
+        if self.is_personal(request):
+            key = (f'{key}:{request.user.pk}:'
+                   f'{get_user_version(request.user.pk)}')
+        return super().get_etag(request, key)
+
+    def personal_querysets(self, request, recipes):
+        """id избранных рецептов, рецептов в корзине и подписок на авторов."""
+        user = request.user
+        if user.is_anonymous or not recipes:
+            return ()
+        recipe_ids = [recipe['id'] for recipe in recipes]
+        return (
+            user.favorites.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True),
+            user.shopping_cart.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True),
+            user.follower.filter(
+                author_id__in={recipe['author']['id'] for recipe in recipes}
+            ).values_list('author_id', flat=True),
+        )
+
+    def personalize(self, request, data):
+        """Флаги избранного, корзины и подписки для текущего пользователя."""
+        recipes = data['results'] if 'results' in data else [data]
+        personal = [
+            set(queryset)
+            for queryset in self.personal_querysets(request, recipes)
+        ]
+        return self.set_personal_flags(data, recipes, *personal)
+
+    async def apersonalize(self, request, data):
+        """personalize() на асинхронном ORM."""
+        recipes = data['results'] if 'results' in data else [data]
+        personal = []
+        for queryset in self.personal_querysets(request, recipes):
+            personal.append({pk async for pk in queryset})
+        return self.set_personal_flags(data, recipes, *personal)
+
+    def set_personal_flags(self, data, recipes, favorited=(), in_cart=(),
+                           subscribed=()):
+        for recipe in recipes:
+            recipe['is_favorited'] = recipe['id'] in favorited
+            recipe['is_in_shopping_cart'] = recipe['id'] in in_cart
+            recipe['author']['is_subscribed'] = (
+                recipe['author']['id'] in subscribed)
+        return data
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -43,32 +160,112 @@ class RecipeViewSet(ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(detail=False)
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated, ],
+        renderer_classes=[ShoppingCartTextRenderer, ShoppingCartCSVRenderer,
+                          ShoppingCartJSONRenderer],
+    )
     def download_shopping_cart(self, request):
-        ingredients = (RecipeIngredient.objects.filter(
-            recipe__shopping_cart__user=request.user).values(
-            'ingredient__name',
-            'ingredient__measurement_unit',).annotate(
-            amount=Sum('amount')).order_by()
-        )
-        data = []
-        for ingredient in ingredients:
-            name = ingredient['ingredient__name']
-            measurement_unit = ingredient['ingredient__measurement_unit']
-            amount = ingredient['amount']
-            data.append(f'{name}: {amount}, {measurement_unit}\n')
-        response = HttpResponse(content=data, content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename="cart.txt"'
+        """Потоковая выгрузка списка покупок в формате txt, csv или json."""
+        renderer = request.accepted_renderer
+        ingredients = request.user.shopping_list.values(
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        ).order_by('name').iterator(chunk_size=SHOPPING_CART_CHUNK_SIZE)
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = (
+            f'attachment; filename="cart.{renderer.format}"')
         return response
 
+    @action(detail=False, permission_classes=[IsAuthenticated, ],
+            pagination_class=FeedPagination)
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь."""
+        paginator = self.paginator
+        ids = paginator.paginate_feed(
+            functools.partial(TimelineEntry.objects.feed, request.user.pk),
+            request)
+        recipes = self.get_queryset().filter(id__in=ids).order_by('-id')
+        serializer = self.get_serializer(recipes, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-class IngredientViewSet(ModelViewSet):
+    @action(detail=False, permission_classes=[IsAdminUser, ])
+    def export(self, request):
+        """Потоковая выгрузка всех рецептов в NDJSON.
+
+        С параметром images=inline изображения встраиваются в base64,
+        иначе передаются именами файлов в хранилище.
+        """
+        response = StreamingHttpResponse(
+            export_recipes(request.query_params.get('images') == 'inline'),
+            content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = (
+            'attachment; filename="recipes.ndjson"')
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import',
+            permission_classes=[IsAdminUser, ])
+    def import_recipes(self, request):
+        """Импорт рецептов из NDJSON, тело читается построчно."""
+        if request.stream is None:
+            return Response(
+                {'errors': 'Пустое тело запроса.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        report = RecipeImporter(request.user).run(request.stream)
+        return Response(report)
+
+
+class IngredientViewSet(VersionedCacheMixin, AsyncReadMixin, ModelViewSet):
     """Вьюсет для ингредиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filterset_class = IngredientFilter
     permission_classes = [AllowAny, ]
     pagination_class = None
+    cache_models = (Ingredient,)
+    async_actions = ('retrieve',)
+    throttle_scope = 'ingredients'
+
+    def get_throttles(self):
+        """Ограничивается только выгрузка полного списка, поиск дешёвый."""
+        if self.request.query_params.get('name'):
+            return []
+        return super().get_throttles()
+
+    def list(self, request, *args, **kwargs):
+        """Полный список отдаётся из готового сжатого бандла."""
+        if (request.accepted_renderer.format == 'json'
+                and not request.query_params.get('name')):
+            return bundle_response(request, bundle_store.get('ingredients'))
+        return self.get_cached_response(self.search, request)
+
+    def search(self, request):
+        """Поиск по началу названия из индекса в памяти, без запросов к БД."""
+        name = request.query_params.get('name')
+        if not name:
+            return Response(ingredient_index.search())
+        return Response(ingredient_index.search(
+            name, limit=settings.INGREDIENT_SEARCH_LIMIT))
+
+
+def create_relation(manager, error, **kwargs):
+    """Создаёт связь; повтор отклоняет уникальное ограничение в базе.
+
+    Повтор распознаётся по уже существующей связи. Остальные нарушения
+    целостности (внешние ключи, проверки) пробрасываются дальше.
+    """
+    try:
+        with transaction.atomic():
+            return manager.create(**kwargs)
+    except IntegrityError:
+        with use_primary():
+            if not manager.filter(**kwargs).exists():
+                raise
+        raise ValidationError({'errors': error})
 
 
 class Favorite(generics.RetrieveDestroyAPIView,
@@ -84,7 +281,8 @@ class Favorite(generics.RetrieveDestroyAPIView,
     def create(self, request, *args, **kwargs):
         """Добавление в избранное."""
         recipe = self.get_object()
-        favorite = request.user.favorites.create(recipe=recipe)
+        favorite = create_relation(
+            request.user.favorites, 'Рецепт уже в избранном.', recipe=recipe)
         serializer = self.get_serializer(favorite)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -93,19 +291,37 @@ class Favorite(generics.RetrieveDestroyAPIView,
         self.request.user.favorites.filter(recipe=instance).delete()
 
 
-class FollowersViewSet(generics.ListAPIView):
-    """Вьюсет для отображения подписчиков."""
-    queryset = Follow.objects.all()
+class FollowersViewSet(AsyncReadMixin, generics.ListAPIView):
+    """Вьюсет для отображения подписок пользователя."""
     serializer_class = FollowSerializer
     permission_classes = [IsAuthenticated, ]
-    pagination_class = PageNumberPagination
+    pagination_class = CursorOptInPagination
+
+    def get_queryset(self):
+        """Подписки с первыми recipes_limit рецептами каждого автора.
 
-    @action(detail=False, methods=['GET'])
-    def subscriptions(self, request):
-        """Метод для отображения всех подписок пользователя."""
-        follows = request.user.follower
-        serializer = FollowSerializer(follows, many=True)
-        return Response(serializer.data)
+        Рецепты всех авторов страницы загружаются одним запросом:
+        ROW_NUMBER() по автору отбирает не больше recipes_limit штук.
+        """
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time',
+            'author_id')
+        limit = get_recipes_limit(self.request)
+        if limit is not None:
+            recipes = recipes.annotate(row_number=Window(
+                RowNumber(),
+                partition_by=F('author_id'),
+                order_by=F('id').desc(),
+            )).filter(row_number__lte=limit)
+        return self.request.user.follower.select_related(
+            'author'
+        ).annotate(
+            is_subscribed=Value(True),
+        ).prefetch_related(Prefetch(
+            'author__recipes',
+            queryset=recipes,
+            to_attr='subscription_recipes',
+        )).order_by('-id')
 
 
 class Follows(generics.RetrieveDestroyAPIView,
@@ -118,7 +334,9 @@ class Follows(generics.RetrieveDestroyAPIView,
     def create(self, request, *args, **kwargs):
         """Создание подписки."""
         user_author = get_object_or_404(User, id=self.kwargs['user_id'])
-        follow = request.user.follower.create(author=user_author)
+        follow = create_relation(
+            request.user.follower, 'Вы уже подписаны на этого автора.',
+            author=user_author)
         serializer = self.get_serializer(follow)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -147,7 +365,9 @@ class ShoppingCart(generics.RetrieveDestroyAPIView,
     def create(self, request, *args, **kwargs):
         """Добавление в список покупок."""
         recipe = self.get_object()
-        request.user.shopping_cart.create(recipe=recipe)
+        create_relation(
+            request.user.shopping_cart, 'Рецепт уже в списке покупок.',
+            recipe=recipe)
         serializer = self.get_serializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -35,6 +35,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -46,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryProfilingMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +58,30 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Профилирование запросов (api.middleware.QueryProfilingMiddleware):
+# заголовок Server-Timing, доля запросов с записью SQL, порог медленного
+# запроса в миллисекундах и число повторов SQL, считающееся N+1.
+PROFILING_SERVER_TIMING = bool(strtobool(
+    os.getenv('PROFILING_SERVER_TIMING', default='False')))
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.01))
+PROFILING_SLOW_MS = int(os.getenv('PROFILING_SLOW_MS', 500))
+PROFILING_REPEAT_THRESHOLD = int(os.getenv('PROFILING_REPEAT_THRESHOLD', 3))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 ROOT_URLCONF = 'foodgram.urls'
 
 TEMPLATES = [
@@ -91,6 +118,53 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения (api.replicas.ReplicaRouter): адреса через запятую
+# в формате host или host:port, остальные параметры как у default.
+# Пользователь, писавший в базу, REPLICA_PIN_SECONDS секунд читает
+# из основной базы.
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+# Кеш по умолчанию должен быть общим для всех процессов: в нём лежат
+# версии данных (recipes.versions), и изменения из команд manage.py и
+# других worker'ов gunicorn сбрасывают кеши ответов, индекс ингредиентов
+# и справочники только через него. Файловый кеш общий в пределах
+# контейнера, для нескольких серверов нужен Redis. LocMemCache годится
+# только для одного процесса (runserver).
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+    }
+}
+if CACHE_BACKEND.endswith('.FileBasedCache'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+    }
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 60 * 60))
+
+# Кеш пользователей по токенам: число записей в памяти процесса
+# (0 - отключить), время жизни записи в секундах и необязательный
+# общий кеш из CACHES для всех процессов.
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 30))
+TOKEN_CACHE_ALIAS = os.getenv('TOKEN_CACHE_ALIAS', '')
+
 AUTH_USER_MODEL = 'users.User'
 
 # Password validation
@@ -120,7 +194,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
@@ -131,8 +205,37 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS':
     'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.TokenBucketThrottle',
+    ],
+    # Скорость для каждого пользователя или IP в формате 'число/период'
+    # (s, min, hour, day); 'none' отключает ограничение области.
+    'DEFAULT_THROTTLE_RATES': {
+        scope: None if rate.lower() == 'none' else rate
+        for scope, rate in {
+            'shopping_cart': os.getenv('THROTTLE_SHOPPING_CART', '20/min'),
+            'recipe_write': os.getenv('THROTTLE_RECIPE_WRITE', '20/min'),
+            'ingredients': os.getenv('THROTTLE_INGREDIENTS', '60/min'),
+        }.items()
+    },
 }
 
+# Хранилище вёдер TokenBucketThrottle: алиас из CACHES.
+THROTTLE_CACHE_ALIAS = os.getenv('THROTTLE_CACHE_ALIAS', 'default')
+
+# Одновременные дорогие запросы (api.throttling.ConcurrencyLimitMixin):
+# лимит области во всех процессах по счётчику в кеше
+# CONCURRENCY_CACHE_ALIAS (пустой алиас - в памяти процесса);
+# сверх лимита - 503 с Retry-After в секундах.
+CONCURRENCY_LIMITS = {
+    'shopping_cart': int(os.getenv('CONCURRENCY_SHOPPING_CART', 4)),
+    'recipe_write': int(os.getenv('CONCURRENCY_RECIPE_WRITE', 4)),
+    'bulk': int(os.getenv('CONCURRENCY_BULK', 1)),
+}
+CONCURRENCY_CACHE_ALIAS = os.getenv('CONCURRENCY_CACHE_ALIAS', 'default')
+CONCURRENCY_TIMEOUT = int(os.getenv('CONCURRENCY_TIMEOUT', 60))
+CONCURRENCY_RETRY_AFTER = int(os.getenv('CONCURRENCY_RETRY_AFTER', 5))
+
 
 DJOSER = {
     'LOGIN_FIELD': 'email',
@@ -166,10 +269,39 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Уменьшенные копии изображений рецептов: имя размера и длина большей
+# стороны в пикселях. IMAGE_WORKERS - число потоков обработки
+# (0 - обрабатывать сразу после сохранения рецепта).
+IMAGE_VARIANTS = {
+    'small': 320,
+    'medium': 960,
+}
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Ленты рецептов подписок (recipes.models.TimelineEntry): авторы
+# с FEED_PUSH_MAX_FOLLOWERS подписчиков и больше не рассылают рецепты,
+# их рецепты читаются при чтении ленты. FEED_BACKFILL_SIZE - сколько
+# последних рецептов автора получает новый подписчик, FEED_WORKERS -
+# потоки рассылки (0 - рассылать сразу после сохранения рецепта).
+FEED_PUSH_MAX_FOLLOWERS = int(os.getenv('FEED_PUSH_MAX_FOLLOWERS', 10000))
+FEED_BACKFILL_SIZE = int(os.getenv('FEED_BACKFILL_SIZE', 100))
+FEED_WORKERS = int(os.getenv('FEED_WORKERS', 2))
+
+# Асинхронные list и retrieve на асинхронном ORM (api.async_views)
+# для запуска под ASGI; включаются в foodgram/asgi.py.
+ASYNC_READ_VIEWS = bool(strtobool(
+    os.getenv('ASYNC_READ_VIEWS', default='False')))
+
+# Каталог, куда выгружаются сжатые справочники тегов и ингредиентов
+# для раздачи через nginx; пустое значение отключает выгрузку.
+BUNDLES_ROOT = os.getenv('BUNDLES_ROOT', '')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CSRF_TRUSTED_ORIGINS = ['https://foodgram-practicum.freedynamicdns.org']
 
 PASSWORD_RESET_TIMEOUT = 60 * 60
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
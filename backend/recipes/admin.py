@@ -1,7 +1,9 @@
 from django.contrib import admin
+from django.db import transaction
 
 from .models import (Favorite, Ingredient, Recipe,
-                     RecipeIngredient, ShoppingCart, Tag)
+                     RecipeIngredient, ShoppingCart, ShoppingList, Tag)
+from .versions import bump_version
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -37,6 +39,16 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
         "amount",
     )
 
+    # Сохранение строк состава увеличивает версию рецептов сигналом,
+    # удаление - здесь (см. VERSIONED_MODELS в recipes.signals).
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(lambda: bump_version(Recipe))
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(lambda: bump_version(Recipe))
+
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
@@ -52,9 +64,10 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     inlines = (RecipeIngredientInline, )
 
-    @admin.display(description='Количество избранных')
+    @admin.display(description='Количество избранных',
+                   ordering='favorites_count')
     def count_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
 
 @admin.register(Favorite)
@@ -73,3 +86,13 @@ class ShoppingCartAdmin(admin.ModelAdmin):
         "user",
         "recipe",
     )
+
+
+@admin.register(ShoppingList)
+class ShoppingListAdmin(admin.ModelAdmin):
+    list_display = (
+        "pk",
+        "user",
+        "ingredient",
+        "amount",
+    )
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core import checks
+
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Версии данных должны храниться в общем для процессов кеше.
+
+    С кешем в памяти процесса изменения, сделанные командами manage.py
+    или другим worker'ом, не сбрасывают кеши ответов, индекс
+    ингредиентов и справочники работающих процессов.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend not in LOCAL_CACHES:
+        return []
+    return [checks.Warning(
+        f'Кеш по умолчанию {backend} не общий для процессов: версии '
+        f'данных из команд manage.py и других worker\'ов не дойдут до '
+        f'работающих процессов, и они будут отдавать устаревшие данные.',
+        hint='Укажите CACHE_BACKEND с файловым кешем или Redis '
+             'или запускайте один процесс.',
+        id='recipes.W001',
+    )]
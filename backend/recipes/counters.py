@@ -0,0 +1,60 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from users.models import Follow, User
+
+from .models import Favorite, Recipe, ShoppingCart
+
+# (модель со счётчиком, поле счётчика, считаемая модель, внешний ключ)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def connect_counter(model, field, source, foreign_key):
+    """Подключает обновление счётчика при создании и удалении source."""
+    attname = source._meta.get_field(foreign_key).attname
+
+    def increment(sender, instance, created, **kwargs):
+        if created:
+            model.objects.filter(pk=getattr(instance, attname)).update(
+                **{field: F(field) + 1})
+
+    def decrement(sender, instance, **kwargs):
+        model.objects.filter(pk=getattr(instance, attname)).update(
+            **{field: Greatest(F(field) - 1, 0)})
+
+    post_save.connect(increment, sender=source, weak=False,
+                      dispatch_uid=f'{field}_increment')
+    post_delete.connect(decrement, sender=source, weak=False,
+                        dispatch_uid=f'{field}_decrement')
+
+
+def actual_count(source, foreign_key):
+    """Подзапрос с реальным количеством строк source для OuterRef('pk')."""
+    return Coalesce(Subquery(
+        source.objects.filter(
+            **{foreign_key: OuterRef('pk')}
+        ).order_by().values(foreign_key).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def reconcile(fix=True):
+    """Сверяет счётчики с данными, при fix=True исправляет расхождения.
+
+    Возвращает словарь {поле: количество строк с расхождением}.
+    """
+    drift = {}
+    for model, field, source, foreign_key in COUNTERS:
+        real = actual_count(source, foreign_key)
+        drifted = model.objects.annotate(real=real).exclude(
+            **{field: F('real')})
+        drift[f'{model._meta.model_name}.{field}'] = drifted.count()
+        if fix:
+            model.objects.update(**{field: real})
+    return drift
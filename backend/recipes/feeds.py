@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db import transaction
+
+from .models import TimelineEntry
+from .workers import submit
+
+
+def fan_out(recipe_id, author_id):
+    """Рассылает уже сохранённый рецепт в пуле.
+
+    При FEED_WORKERS = 0 рецепт рассылается сразу в текущем потоке.
+    """
+    submit(
+        'recipe-feeds', settings.FEED_WORKERS,
+        TimelineEntry.objects.push, recipe_id, author_id,
+        error=f'Не удалось разослать рецепт {recipe_id} в ленты')
+
+
+def schedule_fan_out(recipe):
+    """Ставит рассылку нового рецепта в пул после фиксации транзакции."""
+    recipe_id, author_id = recipe.pk, recipe.author_id
+    transaction.on_commit(lambda: fan_out(recipe_id, author_id))
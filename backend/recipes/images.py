@@ -0,0 +1,118 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+from .storage import content_storage
+from .versions import bump_version
+from .workers import submit
+
+VARIANTS_DIR = 'recipes/variants'
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def needs_processing(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') != recipe.image.name)
+
+
+def variant_names(image_name):
+    """Имена файлов вариантов: {размер: {формат: имя}}.
+
+    Имя строится из имени исходного файла и размера в пикселях, поэтому
+    у одного исходного изображения всегда одни и те же варианты.
+    """
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return {
+        size_name: {
+            extension: f'{VARIANTS_DIR}/{stem}-{size}.{extension}'
+            for extension in FORMATS
+        } for size_name, size in settings.IMAGE_VARIANTS.items()
+    }
+
+
+def render_variants(image_name, overwrite=False):
+    """Уменьшенные копии изображения во всех размерах и форматах.
+
+    Возвращает словарь {размер: {формат: имя файла}} и ключ source
+    с именем исходного файла. Уже существующие копии пересоздаются
+    только при overwrite.
+    """
+    names = variant_names(image_name)
+    missing = [
+        (size_name, extension, name)
+        for size_name, files in names.items()
+        for extension, name in files.items()
+        if overwrite or not default_storage.exists(name)
+    ]
+    if missing:
+        with content_storage.open(image_name) as file:
+            image = ImageOps.exif_transpose(Image.open(file))
+            image.load()
+    for size_name, extension, name in missing:
+        size = settings.IMAGE_VARIANTS[size_name]
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        image_format, options = FORMATS[extension]
+        if image_format == 'JPEG' or resized.mode not in ('RGB', 'RGBA'):
+            resized = resized.convert(
+                'RGB' if image_format == 'JPEG' else 'RGBA')
+        buffer = io.BytesIO()
+        resized.save(buffer, image_format, **options)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        default_storage.save(name, ContentFile(buffer.getvalue()))
+    return {'source': image_name, **names}
+
+
+def release_image(image_name):
+    """Удаляет изображение и его варианты, если на него нет ссылок.
+
+    Одинаковые загрузки хранятся одним файлом, поэтому число ссылок
+    на файл - это число рецептов с таким изображением.
+    """
+    if not image_name or Recipe.objects.filter(image=image_name).exists():
+        return False
+    content_storage.delete(image_name)
+    for files in variant_names(image_name).values():
+        for name in files.values():
+            default_storage.delete(name)
+    return True
+
+
+def process_recipe_image(recipe_id, image_name, overwrite=False):
+    """Создаёт варианты изображения и сохраняет их имена в рецепте.
+
+    Если изображение рецепта успело смениться, результат отбрасывается:
+    его обработает задача, поставленная для нового файла.
+    """
+    if not Recipe.objects.filter(pk=recipe_id, image=image_name).exists():
+        return
+    variants = render_variants(image_name, overwrite)
+    if Recipe.objects.filter(
+        pk=recipe_id, image=image_name
+    ).update(image_variants=variants):
+        transaction.on_commit(lambda: bump_version(Recipe))
+
+
+def schedule_image_processing(recipe):
+    """Ставит обработку изображения в пул после фиксации транзакции.
+
+    При IMAGE_WORKERS = 0 изображение обрабатывается сразу в текущем
+    потоке, что удобно для отладки и тестов.
+    """
+    if not needs_processing(recipe):
+        return
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    transaction.on_commit(lambda: submit(
+        'recipe-images', settings.IMAGE_WORKERS,
+        process_recipe_image, recipe_id, image_name,
+        error=f'Не удалось обработать изображение рецепта {recipe_id}'))
@@ -0,0 +1,98 @@
+import os
+import re
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from recipes.images import VARIANTS_DIR, variant_names
+from recipes.models import Recipe
+from recipes.storage import content_storage
+from recipes.versions import bump_version
+
+CONTENT_NAME = re.compile(r'.*/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?')
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит изображения рецептов в хранилище с именами по хешу '
+        'содержимого: одинаковые файлы сливаются в один, ссылки '
+        'в рецептах обновляются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать, сколько файлов будет слито.')
+        parser.add_argument(
+            '--delete-orphans', action='store_true',
+            help='Удалить файлы изображений, на которые нет ссылок.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        upload_to = Recipe._meta.get_field('image').upload_to.rstrip('/')
+        names = Recipe.objects.exclude(image='').order_by(
+            'image').values_list('image', flat=True).distinct()
+        targets = set()
+        seen = set()
+        moved = missing = freed = 0
+        for name in names.iterator():
+            seen.add(name)
+            if CONTENT_NAME.fullmatch(name):
+                targets.add(name)
+                continue
+            new_name = f'{upload_to}/{os.path.basename(name)}'
+            try:
+                with content_storage.open(name) as file:
+                    size = file.size
+                    if dry_run:
+                        target = content_storage.content_name(new_name, file)
+                    else:
+                        target = content_storage.save(new_name, file)
+            except FileNotFoundError:
+                missing += 1
+                self.stderr.write(f'Файл не найден: {name}')
+                continue
+            if target in targets:
+                freed += size
+            targets.add(target)
+            moved += 1
+            if dry_run:
+                continue
+            Recipe.objects.filter(image=name).update(
+                image=target, image_variants={})
+            content_storage.delete(name)
+            for files in variant_names(name).values():
+                for variant in files.values():
+                    default_storage.delete(variant)
+        orphans = []
+        if options['delete_orphans']:
+            orphans = self.orphans(targets | seen)
+        for name in orphans:
+            freed += content_storage.size(name)
+            if not dry_run:
+                content_storage.delete(name)
+        verb = 'будет перенесено' if dry_run else 'перенесено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Изображений {verb}: {moved}, уникальных: {len(targets)}, '
+            f'не найдено: {missing}, лишних файлов: {len(orphans)}, '
+            f'освобождается {freed // 1024} КБ.'))
+        if moved and not dry_run:
+            bump_version(Recipe)
+            call_command('processimages', stdout=self.stdout)
+
+    def orphans(self, referenced):
+        """Файлы в каталоге изображений рецептов, на которые нет ссылок."""
+        upload_to = Recipe._meta.get_field('image').upload_to.rstrip('/')
+        root = content_storage.path(upload_to)
+        variants_root = default_storage.path(VARIANTS_DIR)
+        orphans = []
+        for directory, _, files in os.walk(root):
+            if directory.startswith(variants_root):
+                continue
+            for file in files:
+                name = os.path.relpath(
+                    os.path.join(directory, file), content_storage.location
+                ).replace(os.sep, '/')
+                if name not in referenced:
+                    orphans.append(name)
+        return orphans
@@ -0,0 +1,146 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F, Min
+from recipes.models import (Favorite, Ingredient, RecipeIngredient,
+                            ShoppingCart, ShoppingList)
+from recipes.versions import bump_version
+from users.models import Follow
+
+# Модели с количеством ингредиента и поле владельца строки.
+INGREDIENT_AMOUNTS = (
+    (RecipeIngredient, 'recipe'),
+    (ShoppingList, 'user'),
+)
+
+# Связи и поля, по которым они должны быть уникальны.
+RELATIONS = (
+    (Favorite, ('user', 'recipe')),
+    (ShoppingCart, ('user', 'recipe')),
+    (Follow, ('user', 'author')),
+    (RecipeIngredient, ('recipe', 'ingredient')),
+)
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Объединяет повторяющиеся ингредиенты (одинаковые название '
+        'и единица измерения), удаляет повторяющиеся избранное, корзины, '
+        'подписки, ингредиенты рецептов и подписки на себя, оставляя '
+        'самую раннюю запись. '
+        'Запускается перед migrate, добавляющим уникальные ограничения, '
+        'поэтому работает со старой схемой: таблицы и столбцы, которых '
+        'ещё нет, пропускаются, а строки удаляются без сигналов. После '
+        'migrate запустите reconcilecounters и rebuildshoppinglists.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать лишние записи.')
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            self.columns = {
+                table: {
+                    column.name for column in
+                    connection.introspection.get_table_description(
+                        cursor, table)
+                }
+                for table in connection.introspection.table_names(cursor)
+            }
+        deleted = 0
+        with transaction.atomic():
+            if self.exists(Ingredient, ('name', 'measurement_unit')):
+                deleted += self.merge_ingredients(options['dry_run'])
+            for model, fields in RELATIONS:
+                if not self.exists(model, fields):
+                    continue
+                keep = model.objects.values(*fields).annotate(
+                    keep=Min('id')).values('keep')
+                extra = model.objects.exclude(id__in=keep)
+                if model is Follow:
+                    extra = extra | model.objects.filter(user=F('author'))
+                ids = list(extra.values_list('id', flat=True))
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}: лишних {len(ids)}')
+                if not options['dry_run']:
+                    self.delete_rows(model, ids)
+                deleted += len(ids)
+            if deleted and not options['dry_run']:
+                transaction.on_commit(lambda: bump_version(Ingredient))
+        self.stdout.write(self.style.SUCCESS(
+            'Повторов нет.' if not deleted else
+            f'Найдено лишних записей: {deleted}.'))
+
+    def exists(self, model, fields):
+        """Есть ли в базе таблица модели со столбцами id и fields."""
+        columns = self.columns.get(model._meta.db_table)
+        if columns is None:
+            return False
+        return {'id', *(
+            model._meta.get_field(field).column for field in fields
+        )} <= columns
+
+    def delete_rows(self, model, ids):
+        """Удаляет строки по id одним DELETE на пачку.
+
+        QuerySet.delete() отправил бы сигналы post_delete: счётчики
+        и списки покупок обновляются в столбцах и таблицах, которые
+        до migrate могут ещё не существовать.
+        """
+        table = connection.ops.quote_name(model._meta.db_table)
+        with connection.cursor() as cursor:
+            for start in range(0, len(ids), BATCH_SIZE):
+                batch = ids[start:start + BATCH_SIZE]
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE id IN ({placeholders})',
+                    batch)
+
+    def merge_ingredients(self, dry_run):
+        """Переносит ссылки с повторов ингредиента на самый ранний.
+
+        Если у рецепта или списка покупок уже есть строка с оставляемым
+        ингредиентом, количества складываются в одну строку.
+        """
+        canonical = {}
+        keep = {}
+        for pk, name, unit in Ingredient.objects.order_by(
+                'id').values_list('id', 'name', 'measurement_unit'):
+            canonical[pk] = keep.setdefault((name, unit), pk)
+        extra = {pk: target for pk, target in canonical.items()
+                 if pk != target}
+        self.stdout.write(
+            f'{Ingredient._meta.verbose_name_plural}: лишних {len(extra)}')
+        if not extra or dry_run:
+            return len(extra)
+        targets = set(extra.values())
+        for model, owner in INGREDIENT_AMOUNTS:
+            if not self.exists(model, (owner, 'ingredient', 'amount')):
+                continue
+            rows = {}
+            for pk, owner_id, ingredient_id, amount in model.objects.filter(
+                    ingredient_id__in=targets | set(extra)).order_by(
+                    'id').values_list('id', owner, 'ingredient', 'amount'):
+                key = (owner_id, canonical[ingredient_id])
+                rows.setdefault(key, []).append(
+                    model(id=pk, ingredient_id=ingredient_id, amount=amount))
+            survivors, duplicates = [], []
+            for (_, target), group in rows.items():
+                survivor = next(
+                    (row for row in group if row.ingredient_id == target),
+                    group[0])
+                if len(group) == 1 and survivor.ingredient_id == target:
+                    continue
+                survivor.amount = sum(row.amount for row in group)
+                survivor.ingredient_id = target
+                survivors.append(survivor)
+                duplicates.extend(
+                    row.pk for row in group if row is not survivor)
+            self.delete_rows(model, duplicates)
+            model.objects.bulk_update(
+                survivors, ('ingredient_id', 'amount'), batch_size=BATCH_SIZE)
+        self.delete_rows(Ingredient, list(extra))
+        return len(extra)
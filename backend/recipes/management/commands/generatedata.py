@@ -0,0 +1,208 @@
+import functools
+import itertools
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.counters import reconcile
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingList, Tag)
+from recipes.versions import bump_user_version, bump_version
+from users.models import Follow, User
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def zipf_weights(size, exponent):
+    """Накопленные веса распределения Ципфа для rnd.choices."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, рецептами, '
+        'избранным, корзинами и подписками для нагрузочного тестирования.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Количество дополнительных тегов.')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8,
+                            help='Среднее число ингредиентов в рецепте.')
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--carts-per-user', type=int, default=5)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Показатель Ципфа для популярности '
+                                 'авторов и рецептов.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='gen',
+                            help='Префикс имён создаваемых пользователей.')
+
+    def handle(self, *args, **options):
+        self.rnd = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        self.prefix = f'{options["prefix"]}_'
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredients:
+            raise CommandError(
+                'Список ингредиентов пуст, сначала выполните loaddata.')
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {options["prefix"]} уже есть, '
+                'укажите другой --prefix.')
+
+        users = self.create_users(options['users'])
+        tags = self.create_tags(options['tags'])
+        recipes = self.create_recipes(options['recipes'], users)
+        self.bulk_insert(
+            Recipe.tags.through,
+            (Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+             for recipe in recipes
+             for tag in self.sample(tags, self.rnd.randint(1, 3))))
+        self.bulk_insert(
+            RecipeIngredient,
+            (RecipeIngredient(
+                recipe_id=recipe, ingredient_id=ingredient,
+                amount=self.rnd.randint(1, 1000))
+             for recipe in recipes
+             for ingredient in self.sample(
+                 ingredients,
+                 self.heavy_tail(options['ingredients_per_recipe']) or 1)))
+        recipe_weights = zipf_weights(len(recipes), self.skew)
+        self.bulk_insert(
+            Favorite,
+            (Favorite(user_id=user, recipe_id=recipe)
+             for user in users
+             for recipe in self.weighted_sample(
+                 recipes, recipe_weights,
+                 self.heavy_tail(options['favorites_per_user']))))
+        self.bulk_insert(
+            ShoppingCart,
+            (ShoppingCart(user_id=user, recipe_id=recipe)
+             for user in users
+             for recipe in self.weighted_sample(
+                 recipes, recipe_weights,
+                 self.heavy_tail(options['carts_per_user']))))
+        user_weights = zipf_weights(len(users), self.skew)
+        self.bulk_insert(
+            Follow,
+            (Follow(user_id=user, author_id=author)
+             for user in users
+             for author in self.weighted_sample(
+                 users, user_weights,
+                 self.heavy_tail(options['follows_per_user']))
+             if author != user))
+        started = time.monotonic()
+        count = ShoppingList.objects.rebuild(self.batch_size)
+        self.stdout.write(
+            f'{ShoppingList._meta.verbose_name_plural}: {count} '
+            f'за {time.monotonic() - started:.1f} с')
+        started = time.monotonic()
+        reconcile()
+        self.stdout.write(
+            f'Счётчики пересчитаны за {time.monotonic() - started:.1f} с')
+        self.bump_versions(users)
+        self.stdout.write(self.style.SUCCESS('Готово.'))
+
+    def bump_versions(self, users):
+        """Увеличивает версии кешей после фиксации всех вставок.
+
+        bulk_create не отправляет сигналы recipes.signals. Теги и состав
+        рецептов входят в версию Recipe, избранное, корзины и подписки -
+        в персональные версии пользователей. Ингредиенты только читаются.
+        """
+        for model in (User, Tag, Recipe):
+            transaction.on_commit(functools.partial(bump_version, model))
+        for user in users:
+            transaction.on_commit(functools.partial(bump_user_version, user))
+
+    def heavy_tail(self, mean):
+        """Количество с тяжёлым хвостом (Парето) и заданным средним."""
+        return int(mean * self.rnd.paretovariate(2) / 2)
+
+    def sample(self, population, k):
+        return self.rnd.sample(population, min(k, len(population)))
+
+    def weighted_sample(self, population, cum_weights, k):
+        """Уникальные элементы, выбранные с учётом популярности."""
+        k = min(k, len(population))
+        return set(self.rnd.choices(
+            population, cum_weights=cum_weights, k=k))
+
+    def bulk_insert(self, model, objects):
+        """Вставляет объекты пачками по batch_size."""
+        name = model._meta.verbose_name_plural
+        started = time.monotonic()
+        total = 0
+        with transaction.atomic():
+            while True:
+                batch = list(itertools.islice(objects, self.batch_size))
+                if not batch:
+                    break
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+                total += len(batch)
+        self.stdout.write(
+            f'{name}: {total} за {time.monotonic() - started:.1f} с')
+        return total
+
+    def create_users(self, count):
+        password = make_password(None)
+        self.bulk_insert(
+            User,
+            (User(
+                email=f'{self.prefix}{i}@example.com',
+                username=f'{self.prefix}{i}',
+                first_name=f'Имя{i}',
+                last_name=f'Фамилия{i}',
+                password=password,
+            ) for i in range(count)))
+        return list(User.objects.filter(
+            username__startswith=self.prefix
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_tags(self, count):
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color})
+        self.bulk_insert(
+            Tag,
+            (Tag(
+                name=f'Тег {i}',
+                color=f'#{self.rnd.randrange(0x1000000):06X}',
+                slug=f'{self.prefix}{i}',
+            ) for i in range(count)))
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def create_recipes(self, count, users):
+        """Рецепты, авторы которых распределены по Ципфу."""
+        if not users:
+            return []
+        author_weights = zipf_weights(len(users), self.skew)
+        authors = self.rnd.choices(users, cum_weights=author_weights, k=count)
+        first_id = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+        self.bulk_insert(
+            Recipe,
+            (Recipe(
+                author_id=author,
+                name=f'Рецепт {i}',
+                image='recipes/images/synthetic.png',
+                text=f'Синтетический рецепт номер {i}.',
+                cooking_time=self.rnd.randint(1, 180),
+            ) for i, author in enumerate(authors)))
+        recipes = Recipe.objects.filter(
+            id__gt=first_id, author__username__startswith=self.prefix)
+        recipes.update_search_vector()
+        return list(recipes.order_by('id').values_list('id', flat=True))
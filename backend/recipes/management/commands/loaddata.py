@@ -1,18 +1,168 @@
+import csv
+import io
+import itertools
 import json
+import os
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from recipes.models import Ingredient
+from recipes.versions import bump_version
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(__file__), 'data', 'ingredients.json')
+NAME_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+
+
+def read_csv(file):
+    """Строки CSV без заголовка: название, единица измерения."""
+    for number, row in enumerate(csv.reader(file), 1):
+        if not row:
+            continue
+        if len(row) != 2:
+            raise CommandError(f'Строка {number}: ожидается два поля.')
+        yield number, row[0], row[1]
+
+
+def read_json(file, chunk_size=64 * 1024):
+    """Элементы JSON-массива по одному, без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    number = 0
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise CommandError('Ожидается JSON-массив.')
+            buffer = buffer[1:]
+            started = True
+            continue
+        if started and buffer[:1] in (',', ']'):
+            if buffer[0] == ']':
+                return
+            buffer = buffer[1:]
+            continue
+        if started and buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise CommandError(
+                        f'Некорректный JSON после элемента {number}.')
+            else:
+                number += 1
+                buffer = buffer[end:]
+                try:
+                    yield number, item['name'], item['measurement_unit']
+                except (KeyError, TypeError):
+                    raise CommandError(
+                        f'Элемент {number}: нужны поля name '
+                        'и measurement_unit.')
+                continue
+        if eof:
+            raise CommandError('Неожиданный конец JSON.')
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
 
 
 class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV (название,единица) или JSON пачками. '
+        'Повторный запуск не создаёт дубликатов: уже существующие пары '
+        '(название, единица измерения) пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_PATH,
+            help='Файл .csv или .json, по умолчанию встроенный справочник.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только проверить файл и посчитать новые ингредиенты.')
 
     def handle(self, *args, **options):
-        with open(
-            'recipes/management/commands/data/ingredients.json', 'rb'
-        ) as f:
-            data = json.load(f)
-            for item in data:
-                print(item)
-                Ingredient.objects.create(
-                    name=item['name'],
-                    measurement_unit=item['measurement_unit'])
+        path = options['path']
+        extension = os.path.splitext(path)[1].lower()
+        readers = {'.csv': read_csv, '.json': read_json}
+        if extension not in readers:
+            raise CommandError('Поддерживаются файлы .csv и .json.')
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = self.clean(readers[extension](file))
+            if options['dry_run']:
+                total, created = self.load(rows, self.count_new)
+            else:
+                with transaction.atomic():
+                    load_batch = (
+                        self.copy_batch if connection.vendor == 'postgresql'
+                        else self.insert_batch)
+                    total, created = self.load(rows, load_batch)
+                    if created:
+                        transaction.on_commit(
+                            lambda: bump_version(Ingredient))
+        verb = 'будет добавлено' if options['dry_run'] else 'добавлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {total}, {verb} {created} ингредиентов '
+            f'за {time.monotonic() - started:.1f} с.'))
+
+    def clean(self, rows):
+        for number, name, unit in rows:
+            name, unit = str(name).strip(), str(unit).strip()
+            if not name or not unit:
+                raise CommandError(
+                    f'Запись {number}: пустое название или единица.')
+            if len(name) > NAME_LENGTH or len(unit) > UNIT_LENGTH:
+                raise CommandError(f'Запись {number}: слишком длинное поле.')
+            yield name, unit
+
+    def load(self, rows, load_batch):
+        """Загружает строки пачками и выводит прогресс."""
+        total = created = 0
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return total, created
+            total += len(batch)
+            created += load_batch(batch)
+            self.stdout.write(f'Обработано {total}, новых {created}')
+
+    def count_new(self, batch):
+        keys = set(batch)
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in keys}
+        ).values_list('name', 'measurement_unit'))
+        return len(keys - existing)
+
+    def insert_batch(self, batch):
+        before = Ingredient.objects.count()
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=unit)
+             for name, unit in batch),
+            batch_size=self.batch_size, ignore_conflicts=True)
+        return Ingredient.objects.count() - before
+
+    def copy_batch(self, batch):
+        """COPY во временную таблицу и вставка с ON CONFLICT DO NOTHING."""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS ingredient_load '
+                '(name text, measurement_unit text) ON COMMIT DROP')
+            cursor.execute('TRUNCATE ingredient_load')
+            cursor.copy_expert(
+                'COPY ingredient_load FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit FROM ingredient_load '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING')
+            return cursor.rowcount
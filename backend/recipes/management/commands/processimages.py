@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from recipes.images import needs_processing, process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт уменьшенные копии изображений рецептов, для которых '
+        'их ещё нет (например, после загрузки данных в обход API).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать копии для всех рецептов.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_variants').order_by('id')
+        processed = failed = 0
+        for recipe in recipes.iterator():
+            if not options['all'] and not needs_processing(recipe):
+                continue
+            try:
+                process_recipe_image(
+                    recipe.id, recipe.image.name, options['all'])
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe.id}: {error}')
+                continue
+            processed += 1
+            if processed % 100 == 0:
+                self.stdout.write(f'Обработано {processed}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано {processed}, с ошибками {failed}.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from recipes.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает ленты рецептов подписок: каждый подписчик получает '
+        'последние FEED_BACKFILL_SIZE рецептов каждого автора, который '
+        'рассылает рецепты. Запускается после generatedata или массовой '
+        'загрузки, а также после изменения FEED_PUSH_MAX_FOLLOWERS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        count = TimelineEntry.objects.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты пересобраны, записей: {count}.'))
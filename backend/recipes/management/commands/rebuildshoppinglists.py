@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import ShoppingList
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает агрегированные списки покупок из корзин '
+        'или проверяет их (--verify).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сверить списки с корзинами, ничего не меняя.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = self.verify(options['batch_size'])
+            if mismatches:
+                raise CommandError(
+                    f'Расхождений в списках покупок: {mismatches}. '
+                    'Запустите команду без --verify.')
+            self.stdout.write(self.style.SUCCESS('Списки покупок актуальны.'))
+            return
+        count = ShoppingList.objects.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны, строк: {count}.'))
+
+    def verify(self, batch_size):
+        """Сверяет таблицу с агрегатом слиянием двух упорядоченных потоков."""
+        expected = (
+            ((row['user_id'], row['ingredient_id']), row['total'])
+            for row in ShoppingList.objects.expected().iterator(
+                chunk_size=batch_size))
+        actual = (
+            ((row[0], row[1]), row[2])
+            for row in ShoppingList.objects.order_by(
+                'user_id', 'ingredient_id'
+            ).values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator(chunk_size=batch_size))
+        mismatches = 0
+        expected_row, actual_row = next(expected, None), next(actual, None)
+        while expected_row or actual_row:
+            if actual_row is None or (
+                    expected_row and expected_row[0] < actual_row[0]):
+                self.report('нет строки, ожидалось', *expected_row)
+                expected_row = next(expected, None)
+            elif expected_row is None or expected_row[0] > actual_row[0]:
+                self.report('лишняя строка', *actual_row)
+                actual_row = next(actual, None)
+            elif expected_row[1] != actual_row[1]:
+                self.report(
+                    f'ожидалось {expected_row[1]}, в таблице', *actual_row)
+                expected_row, actual_row = (
+                    next(expected, None), next(actual, None))
+            else:
+                expected_row, actual_row = (
+                    next(expected, None), next(actual, None))
+                continue
+            mismatches += 1
+        return mismatches
+
+    def report(self, message, key, amount):
+        user_id, ingredient_id = key
+        self.stderr.write(
+            f'user={user_id} ingredient={ingredient_id}: {message} {amount}')
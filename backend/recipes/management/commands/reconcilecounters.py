@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики избранного, корзин, рецептов и подписчиков '
+        'или проверяет их (--verify).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сверить счётчики, ничего не меняя.')
+
+    def handle(self, *args, **options):
+        drift = reconcile(fix=not options['verify'])
+        for field, count in drift.items():
+            self.stdout.write(f'{field}: расхождений {count}')
+        if options['verify'] and any(drift.values()):
+            raise CommandError(
+                'Счётчики расходятся с данными. '
+                'Запустите команду без --verify.')
+        self.stdout.write(self.style.SUCCESS('Счётчики актуальны.'))
@@ -1,6 +1,15 @@
-from django.db import models
+import itertools
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connections, models, router, transaction
 from django.core.validators import MinValueValidator
-from users.models import User
+from users.models import CountersMixin, Follow, User
+
+from .storage import content_storage
+
+SEARCH_CONFIG = 'russian'
 
 
 class Tag(models.Model):
@@ -41,12 +50,41 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("name", "measurement_unit"),
+                name="unique_ingredient",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=("name",),
+                name="ingredient_name_like_idx",
+                opclasses=("varchar_pattern_ops",),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name}, {self.measurement_unit}"
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def update_search_vector(self):
+        """Пересчитывает полнотекстовый вектор по названию и описанию."""
+        if self.db_vendor != 'postgresql':
+            return 0
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+        ))
+
+    @property
+    def db_vendor(self):
+        return connections[self.db].vendor
+
+
+class Recipe(CountersMixin, models.Model):
     """Модель рецептов."""
     tags = models.ManyToManyField(
         Tag,
@@ -64,21 +102,69 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to="recipes/",
+        storage=content_storage,
+        db_index=True,
         verbose_name="Изображение",
     )
     text = models.TextField(verbose_name="Описание")
     cooking_time = models.PositiveIntegerField(
         validators=[MinValueValidator(1)],
     )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name="Поисковый вектор",
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Количество добавлений в избранное",
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Количество добавлений в корзину",
+    )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Уменьшенные копии изображения",
+    )
+
+    counter_fields = ("favorites_count", "shopping_cart_count")
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ("-id",)
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
+        indexes = [
+            GinIndex(
+                fields=("search_vector",),
+                name="recipe_search_vector_idx",
+            ),
+            GinIndex(
+                fields=("name",),
+                name="recipe_name_trgm_idx",
+                opclasses=("gin_trgm_ops",),
+            ),
+            models.Index(
+                fields=("-favorites_count", "-id"),
+                name="recipe_favorites_count_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.original_image = instance.__dict__.get("image")
+        return instance
+
 
 class RecipeIngredient(models.Model):
     """Модель связи рецепта и ингредиента."""
@@ -86,6 +172,7 @@ class RecipeIngredient(models.Model):
         Recipe,
         on_delete=models.CASCADE,
         related_name='ingredients',
+        db_index=False,
     )
     ingredient = models.ForeignKey(
         Ingredient,
@@ -101,6 +188,14 @@ class RecipeIngredient(models.Model):
     class Meta:
         verbose_name = "Количество ингредиента"
         verbose_name_plural = "Количество ингредиентов"
+        # Индекс ограничения начинается с recipe и заменяет индекс
+        # внешнего ключа.
+        constraints = [
+            models.UniqueConstraint(
+                fields=("recipe", "ingredient"),
+                name="unique_recipe_ingredient",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.ingredient} * {self.amount}"
@@ -113,6 +208,7 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         verbose_name="Пользователь",
         related_name="favorites",
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
@@ -125,6 +221,12 @@ class Favorite(models.Model):
         ordering = ("-id",)
         verbose_name = "Избранный рецепт"
         verbose_name_plural = "Избранные рецепты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "recipe"),
+                name="unique_favorite",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} добавил рецепт {self.recipe}"
@@ -137,6 +239,7 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name="shopping_cart",
         verbose_name="Пользователь",
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
@@ -149,6 +252,272 @@ class ShoppingCart(models.Model):
         ordering = ("-id",)
         verbose_name = "Корзина"
         verbose_name_plural = "В корзине"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "recipe"),
+                name="unique_shopping_cart",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} добавил рецепт {self.recipe}"
+
+
+class ShoppingListQuerySet(models.QuerySet):
+    """Поддержка агрегированного списка покупок в актуальном состоянии."""
+
+    def expected(self):
+        """Суммы ингредиентов по корзинам, посчитанные с нуля."""
+        return RecipeIngredient.objects.filter(
+            recipe__shopping_cart__isnull=False
+        ).values(
+            'ingredient_id',
+            user_id=models.F('recipe__shopping_cart__user'),
+        ).annotate(
+            total=models.Sum('amount')
+        ).order_by('user_id', 'ingredient_id')
+
+    def recipe_totals(self, recipe_id):
+        """Количество каждого ингредиента в рецепте."""
+        return dict(RecipeIngredient.objects.filter(
+            recipe_id=recipe_id
+        ).values('ingredient_id').annotate(
+            total=models.Sum('amount')
+        ).order_by().values_list('ingredient_id', 'total'))
+
+    def apply(self, user_ids, deltas, batch_size=1000):
+        """Прибавляет deltas {ingredient_id: количество} к спискам users.
+
+        INSERT ... ON CONFLICT DO UPDATE создаёт недостающие строки
+        и прибавляет к существующим одной командой, поэтому параллельные
+        изменения одного списка не теряются и не нарушают уникальность.
+        Строки, где после вычитания не осталось количества, удаляются.
+        """
+        deltas = {
+            ingredient: delta for ingredient, delta in deltas.items() if delta
+        }
+        if not user_ids or not deltas:
+            return
+        rows = [
+            (user, ingredient, delta)
+            for user in user_ids
+            for ingredient, delta in deltas.items()
+        ]
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        user, ingredient, amount = (
+            quote(self.model._meta.get_field(name).column)
+            for name in ('user', 'ingredient', 'amount'))
+        with transaction.atomic(using=using, savepoint=False):
+            with connection.cursor() as cursor:
+                for start in range(0, len(rows), batch_size):
+                    batch = rows[start:start + batch_size]
+                    values = ', '.join(['(%s, %s, %s)'] * len(batch))
+                    cursor.execute(
+                        f'INSERT INTO {table} ({user}, {ingredient}, '
+                        f'{amount}) VALUES {values} '
+                        f'ON CONFLICT ({user}, {ingredient}) DO UPDATE '
+                        f'SET {amount} = {table}.{amount} '
+                        f'+ EXCLUDED.{amount}',
+                        [value for row in batch for value in row])
+            if min(deltas.values()) < 0:
+                self.using(using).filter(
+                    user_id__in=user_ids, ingredient_id__in=deltas,
+                    amount__lte=0,
+                ).delete()
+
+    def add_recipe(self, user_id, recipe_id, sign=1):
+        """Учитывает добавление (или удаление при sign=-1) рецепта."""
+        self.apply([user_id], {
+            ingredient: sign * total
+            for ingredient, total in self.recipe_totals(recipe_id).items()
+        })
+
+    def update_recipe(self, recipe_id, old_totals, new_totals=None):
+        """Переносит изменение состава рецепта в списки всех корзин."""
+        if new_totals is None:
+            new_totals = self.recipe_totals(recipe_id)
+        user_ids = list(ShoppingCart.objects.filter(
+            recipe_id=recipe_id).values_list('user_id', flat=True))
+        self.apply(user_ids, {
+            ingredient: new_totals.get(ingredient, 0)
+            - old_totals.get(ingredient, 0)
+            for ingredient in new_totals.keys() | old_totals.keys()
+        })
+
+    def rebuild(self, batch_size=5000):
+        """Пересобирает все списки покупок из корзин."""
+        with transaction.atomic():
+            self.all().delete()
+            totals = self.expected().iterator(chunk_size=batch_size)
+            count = 0
+            while True:
+                batch = [
+                    self.model(user_id=row['user_id'],
+                               ingredient_id=row['ingredient_id'],
+                               amount=row['total'])
+                    for row in itertools.islice(totals, batch_size)
+                ]
+                if not batch:
+                    return count
+                self.bulk_create(batch)
+                count += len(batch)
+
+
+class ShoppingList(models.Model):
+    """Модель агрегированного списка покупок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_lists",
+        verbose_name="Ингредиент",
+    )
+    amount = models.IntegerField(verbose_name="Количество")
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Список покупок"
+        verbose_name_plural = "Списки покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "ingredient"),
+                name="unique_shopping_list_ingredient",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.ingredient} * {self.amount}"
+
+
+class TimelineQuerySet(models.QuerySet):
+    """Ленты рецептов подписок с рассылкой при публикации.
+
+    Рецепты авторов, у которых не меньше FEED_PUSH_MAX_FOLLOWERS
+    подписчиков, в ленты не рассылаются и читаются из рецептов при
+    чтении ленты.
+    """
+
+    def push(self, recipe_id, author_id, batch_size=1000):
+        """Добавляет рецепт в ленты подписчиков автора."""
+        followers = Follow.objects.filter(
+            author_id=author_id,
+            author__followers_count__lt=settings.FEED_PUSH_MAX_FOLLOWERS,
+        ).order_by().values_list('user_id', flat=True).iterator(
+            chunk_size=batch_size)
+        return self.insert(
+            ((user_id, recipe_id) for user_id in followers), batch_size)
+
+    def backfill(self, user_id, author_id):
+        """Последние FEED_BACKFILL_SIZE рецептов автора в ленту подписчика."""
+        recipe_ids = Recipe.objects.filter(
+            author_id=author_id,
+            author__followers_count__lt=settings.FEED_PUSH_MAX_FOLLOWERS,
+        ).order_by('-id').values_list(
+            'id', flat=True)[:settings.FEED_BACKFILL_SIZE]
+        return self.insert(
+            ((user_id, recipe_id) for recipe_id in recipe_ids),
+            settings.FEED_BACKFILL_SIZE)
+
+    def trim(self, user_id, author_id):
+        """Убирает из ленты подписчика рецепты автора."""
+        return self.filter(
+            user_id=user_id, recipe__author_id=author_id).delete()[0]
+
+    def insert(self, pairs, batch_size):
+        count = 0
+        pairs = iter(pairs)
+        while True:
+            batch = [
+                self.model(user_id=user_id, recipe_id=recipe_id)
+                for user_id, recipe_id in itertools.islice(pairs, batch_size)
+            ]
+            if not batch:
+                return count
+            self.bulk_create(batch, ignore_conflicts=True)
+            count += len(batch)
+
+    def feed(self, user_id, before=None, limit=10):
+        """id рецептов ленты по убыванию, меньше before.
+
+        Разосланные рецепты читаются одним проходом по индексу
+        (user, recipe), рецепты популярных авторов - из рецептов.
+        """
+        pushed = self.filter(user_id=user_id)
+        pulled = Recipe.objects.filter(
+            author__following__user_id=user_id,
+            author__followers_count__gte=settings.FEED_PUSH_MAX_FOLLOWERS)
+        if before is not None:
+            pushed = pushed.filter(recipe_id__lt=before)
+            pulled = pulled.filter(id__lt=before)
+        ids = set(pushed.order_by('-recipe_id').values_list(
+            'recipe_id', flat=True)[:limit])
+        ids.update(pulled.order_by('-id').values_list('id', flat=True)[:limit])
+        return sorted(ids, reverse=True)[:limit]
+
+    def rebuild(self, batch_size=5000):
+        """Пересобирает все ленты из подписок и последних рецептов."""
+        with transaction.atomic():
+            self.all().delete()
+            authors = User.objects.filter(
+                followers_count__gt=0,
+                followers_count__lt=settings.FEED_PUSH_MAX_FOLLOWERS,
+            ).values_list('id', flat=True).iterator(chunk_size=batch_size)
+            count = 0
+            for author_id in authors:
+                recipe_ids = list(Recipe.objects.filter(
+                    author_id=author_id
+                ).order_by('-id').values_list(
+                    'id', flat=True)[:settings.FEED_BACKFILL_SIZE])
+                if not recipe_ids:
+                    continue
+                followers = Follow.objects.filter(
+                    author_id=author_id
+                ).values_list('user_id', flat=True).iterator(
+                    chunk_size=batch_size)
+                count += self.insert((
+                    (user_id, recipe_id)
+                    for user_id in followers
+                    for recipe_id in recipe_ids
+                ), batch_size)
+            return count
+
+
+class TimelineEntry(models.Model):
+    """Модель записи в ленте рецептов подписок."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="timeline",
+        db_index=False,
+        verbose_name="Подписчик",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries",
+        verbose_name="Рецепт",
+    )
+
+    objects = TimelineQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи лент"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "recipe"),
+                name="unique_timeline_entry",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.recipe}"
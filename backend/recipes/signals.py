@@ -0,0 +1,143 @@
+from django.db import connections, transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_migrate)
+from django.dispatch import receiver
+from users.models import Follow, User
+
+from .counters import COUNTERS, connect_counter
+from .feeds import schedule_fan_out
+from .images import release_image, schedule_image_processing
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, ShoppingList, Tag, TimelineEntry)
+from .versions import bump_user_version, bump_version
+
+# Модели, от которых зависят кеши ответов и индексы в памяти, и поля,
+# изменение которых видно в ответах API (None - любые поля).
+# Состав рецепта (RecipeIngredient) входит в версию Recipe: сохранение
+# строки состава увеличивает её в bump_recipe_ingredients_version.
+# Обработчик post_delete на составе отключил бы быстрое каскадное
+# удаление, поэтому отдельное удаление строк в админке увеличивает
+# версию в RecipeIngredientAdmin.
+VERSIONED_MODELS = {
+    Ingredient: None,
+    Recipe: None,
+    Tag: None,
+    User: {'email', 'username', 'first_name', 'last_name'},
+}
+
+
+@receiver(pre_migrate)
+def create_extensions(sender, using, **kwargs):
+    """Расширение pg_trgm нужно для триграммного индекса рецептов."""
+    connection = connections[using]
+    if sender.name == 'recipes' and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(sender, instance, update_fields, **kwargs):
+    """Обновляет поисковый вектор после сохранения рецепта."""
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        Recipe.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=Recipe)
+def process_image(sender, instance, **kwargs):
+    """Уменьшенные копии нового изображения создаются в фоне,
+    прежнее изображение удаляется, если на него больше нет ссылок."""
+    if 'image' in instance.get_deferred_fields():
+        return
+    schedule_image_processing(instance)
+    original = getattr(instance, 'original_image', None)
+    if original and original != instance.image.name:
+        transaction.on_commit(lambda: release_image(original))
+    instance.original_image = instance.image.name
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image(sender, instance, **kwargs):
+    image_name = instance.image.name
+    transaction.on_commit(lambda: release_image(image_name))
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    """Новый рецепт рассылается в ленты подписчиков автора в фоне."""
+    if created:
+        schedule_fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    """В ленту нового подписчика сразу попадают последние рецепты."""
+    if created:
+        TimelineEntry.objects.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    TimelineEntry.objects.trim(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    """Добавляет ингредиенты рецепта в список покупок."""
+    if created:
+        ShoppingList.objects.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    """Вычитает ингредиенты рецепта из списка покупок.
+
+    pre_delete срабатывает до каскадного удаления состава рецепта,
+    поэтому ингредиенты удаляемого рецепта ещё доступны.
+    """
+    ShoppingList.objects.add_recipe(
+        instance.user_id, instance.recipe_id, sign=-1)
+
+
+# Версии увеличиваются только после фиксации транзакции: иначе
+# параллельный запрос успел бы закешировать под новой версией
+# ещё не изменённые данные.
+
+def bump_model_version(sender, update_fields=None, **kwargs):
+    """Отмечает изменение данных модели для кешей."""
+    fields = VERSIONED_MODELS[sender]
+    if fields and update_fields and not fields & set(update_fields):
+        return
+    transaction.on_commit(lambda: bump_version(sender))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipe_tags_version(sender, action, **kwargs):
+    """Изменение тегов рецепта меняет его представление в API."""
+    if action.startswith('post_'):
+        transaction.on_commit(lambda: bump_version(Recipe))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def bump_recipe_ingredients_version(sender, **kwargs):
+    """Изменение строки состава меняет представление рецепта в API."""
+    transaction.on_commit(lambda: bump_version(Recipe))
+
+
+def bump_personal_version(sender, instance, **kwargs):
+    """Избранное, корзина и подписки меняют персональные поля ответов."""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_model_version, sender=model)
+    post_delete.connect(bump_model_version, sender=model)
+
+
+for model in (Favorite, ShoppingCart, Follow):
+    post_save.connect(bump_personal_version, sender=model)
+    post_delete.connect(bump_personal_version, sender=model)
+
+
+for counter in COUNTERS:
+    connect_counter(*counter)
@@ -0,0 +1,64 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'version:{}'
+USER_VERSION_KEY = 'version:user:{}'
+
+
+def get_key_version(key):
+    """Текущее значение счётчика версии по ключу кеша.
+
+    Если ключа в кеше нет (первый запуск или вытеснение), версия
+    начинается с текущего времени в миллисекундах, поэтому новая версия
+    никогда не совпадёт с уже выданной ранее.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns() // 1_000_000, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_key_version(key):
+    """Записывает новое значение версии.
+
+    Вместо cache.incr версия заменяется текущим временем в наносекундах:
+    у файлового кеша incr не атомарен, и два одновременных увеличения
+    из разных процессов дали бы одну и ту же версию. Новое значение
+    отличается от всех выданных ранее, кто бы из процессов ни записал
+    его последним.
+    """
+    version = max(time.time_ns(), (cache.get(key) or 0) + 1)
+    cache.set(key, version, timeout=None)
+    return version
+
+
+def get_version(model):
+    """Текущая версия данных модели."""
+    return get_key_version(VERSION_KEY.format(model._meta.label_lower))
+
+
+def bump_version(model):
+    """Увеличивает версию данных модели после изменения."""
+    return bump_key_version(VERSION_KEY.format(model._meta.label_lower))
+
+
+def get_user_version(user_id):
+    """Версия персональных данных пользователя: избранного,
+    корзины и подписок."""
+    return get_key_version(USER_VERSION_KEY.format(user_id))
+
+
+def bump_user_version(user_id):
+    return bump_key_version(USER_VERSION_KEY.format(user_id))
+
+
+def get_versions(models):
+    """Версии нескольких моделей одним обращением к кешу."""
+    keys = [VERSION_KEY.format(model._meta.label_lower) for model in models]
+    versions = cache.get_many(keys)
+    return [
+        versions[key] if key in versions else get_key_version(key)
+        for key in keys
+    ]
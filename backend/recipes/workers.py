@@ -0,0 +1,49 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name, size):
+    """Общий пул потоков name; size задаёт число потоков при создании."""
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=size, thread_name_prefix=name)
+        return _executors[name]
+
+
+def call_safely(func, *args, error):
+    """Вызывает func; исключение пишется в лог с сообщением error."""
+    try:
+        func(*args)
+    except Exception:
+        logger.exception(error)
+
+
+def run_in_worker(func, *args, error):
+    """Вызов в потоке пула со своим соединением с базой."""
+    try:
+        call_safely(func, *args, error=error)
+    finally:
+        connections.close_all()
+
+
+def submit(name, size, func, *args, error):
+    """Выполняет func(*args) в пуле name из size потоков.
+
+    При size = 0 func выполняется сразу в текущем потоке, что удобно
+    для отладки и тестов. Исключения не пробрасываются, а пишутся
+    в лог с сообщением error.
+    """
+    if size:
+        get_executor(name, size).submit(
+            run_in_worker, func, *args, error=error)
+    else:
+        call_safely(func, *args, error=error)